@@ -0,0 +1,151 @@
+import asyncio
+import weakref
+
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from config import DATABASE_URL, POOL_SIZE, MAX_OVERFLOW, POOL_TIMEOUT, POOL_RECYCLE, STATEMENT_TIMEOUT
+from app.dialects import database_key
+from app.views import EPSILON, NV_VERSION_SQL, _P0_W_CACHE, _aggregate_P0_sql, _complement_from_log, _PQ, _m_PQ
+
+# Asynchronous probability queries for serving many concurrent P(Q) requests.
+#
+# The functions mirror compute_PQ / m_compute_PQ and friends from app.views on an AsyncSession
+# (asyncpg driver), so concurrent requests overlap their round trips on separate pooled
+# connections instead of queueing behind one synchronous session. asyncpg prepares every
+# statement and keeps the plan per connection, so predicate queries reuse their plans like the
+# synchronous PREPARE path does. P0(W) is shared with the synchronous functions through the
+# same per-version cache; when the NV version changes, only one request per event loop
+# recomputes it while the others wait for its result.
+#
+#     async with AsyncQueryService(max_concurrency=50) as service:
+#         probabilities = await service.compute_PQ_many(queries)
+#
+# The async engine always uses asyncpg, so this module needs a PostgreSQL DATABASE_URL.
+
+async_engine = create_async_engine(
+    make_url(DATABASE_URL).set(drivername="postgresql+asyncpg"),
+    pool_size=POOL_SIZE,
+    max_overflow=MAX_OVERFLOW,
+    pool_timeout=POOL_TIMEOUT,
+    pool_recycle=POOL_RECYCLE,
+    pool_pre_ping=True,
+    connect_args={"server_settings": {"statement_timeout": str(STATEMENT_TIMEOUT)}} if STATEMENT_TIMEOUT else {},
+)
+AsyncSession = async_sessionmaker(async_engine, expire_on_commit=False)
+
+# Event loop -> {(database, clamp): asyncio.Lock} guarding the recomputation of P0(W)
+_P0_W_LOCKS = weakref.WeakKeyDictionary()
+
+
+async def get_nv_version(session):
+    return (await session.execute(text(NV_VERSION_SQL))).scalar() or 0
+
+
+async def _aggregate_P0(session, query=None, clamp=None):
+    aggregate_sql, params = _aggregate_P0_sql(query, clamp)
+    row = (await session.execute(text(aggregate_sql), params)).one()
+    return _complement_from_log(row.log_abs, row.n_negative, row.n_zero)
+
+
+async def _cached_P0_W(session, clamp=None):
+    version = await get_nv_version(session)
+    key = (database_key(session), clamp)
+    cached = _P0_W_CACHE.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    # Single flight: the first request computes, the others find the fresh value after the lock
+    locks = _P0_W_LOCKS.setdefault(asyncio.get_running_loop(), {})
+    lock = locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        cached = _P0_W_CACHE.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        value = await _aggregate_P0(session, clamp=clamp)
+        _P0_W_CACHE[key] = (version, value)
+        return value
+
+
+async def compute_P0_Q_or_W(session, query):
+    return await _aggregate_P0(session, query)
+
+
+async def compute_P0_W(session):
+    return await _cached_P0_W(session)
+
+
+async def compute_PQ(session, query):
+    P0_Q_or_W = await compute_P0_Q_or_W(session, query)
+    P0_W = await compute_P0_W(session)
+    return _PQ(P0_Q_or_W, P0_W)
+
+
+async def m_compute_P0_Q_or_W(session, query):
+    return await _aggregate_P0(session, query, clamp=EPSILON)
+
+
+async def m_compute_P0_W(session):
+    return await _cached_P0_W(session, clamp=EPSILON)
+
+
+async def m_compute_PQ(session, query):
+    m_P0_Q_or_W = await m_compute_P0_Q_or_W(session, query)
+    m_P0_W = await m_compute_P0_W(session)
+    return _m_PQ(m_P0_Q_or_W, m_P0_W)
+
+
+class AsyncQueryService:
+    # Runs each request on its own session from the async pool. At most max_concurrency
+    # requests hold a connection at a time (defaults to the pool capacity); the others wait
+    # for a slot, which is the backpressure towards callers. A request cancelled while it
+    # waits never touches the database; one cancelled or timed out mid-query has its
+    # statement cancelled by asyncpg and its connection returned to the pool.
+
+    def __init__(self, engine=async_engine, max_concurrency=None, timeout=None):
+        self.engine = engine
+        self.max_concurrency = max_concurrency or POOL_SIZE + MAX_OVERFLOW
+        self.timeout = timeout  # Seconds per request, None for no limit
+        self.session_factory = async_sessionmaker(engine, expire_on_commit=False)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        # asyncpg connections belong to the event loop that opened them
+        await self.engine.dispose()
+
+    async def _run(self, function, *args):
+        async with self._semaphore:
+            async with self.session_factory() as session:
+                return await asyncio.wait_for(function(session, *args), self.timeout)
+
+    async def compute_PQ(self, query):
+        return await self._run(compute_PQ, query)
+
+    async def m_compute_PQ(self, query):
+        return await self._run(m_compute_PQ, query)
+
+    async def compute_P0_Q_or_W(self, query):
+        return await self._run(compute_P0_Q_or_W, query)
+
+    async def compute_P0_W(self):
+        return await self._run(compute_P0_W)
+
+    async def compute_PQ_many(self, queries, modified=False):
+        # P(Q) for every query, evaluated concurrently and returned in input order. If one
+        # request fails, the others are cancelled and the exception is raised
+        function = self.m_compute_PQ if modified else self.compute_PQ
+        tasks = [asyncio.ensure_future(function(query)) for query in queries]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
@@ -0,0 +1,176 @@
+import argparse
+import contextlib
+import functools
+import io
+import json
+import platform
+import random
+import sys
+import tracemalloc
+from datetime import datetime, timezone
+
+from sqlalchemy import text
+
+from app.generator import GeneratorConfig, generate_dblp_like
+from app.instrumentation import instrumentation
+from app.models import Session, create_tables
+from app.predicates import eq
+from app.dialects import truncate_sql
+from app.result_cache import RESULT_CACHE
+from app.views import create_view_v1, create_view_v2, create_view_v3, create_nv_tables, \
+    populate_nv_tables, transform_mvdb_to_indb, compute_PQ, m_compute_PQ, NV_SOURCES
+
+# End-to-end benchmark of the MarkoViews pipeline against the configured database.
+#
+# For every data size the synthetic generator fills the base tables, then each pipeline stage
+# runs once and records wall time, number of SQL statements and rows touched (through
+# app.instrumentation) and peak Python memory. Results are written as JSON and can be compared with a
+# stored baseline:
+#
+#     python -m app.benchmark --scales 10000 100000 --output bench.json
+#     python -m app.benchmark --scales 10000 100000 --baseline bench.json
+#
+# WARNING: the benchmark replaces the contents of the base and NV tables.
+
+DEFAULT_SCALES = (10000, 100000)
+REGRESSION_THRESHOLD = 1.2  # A stage is flagged when it gets this much slower than the baseline
+
+
+def _measure(stage, scale, function, results, trace_memory=True):
+    # tracemalloc slows down Python-heavy stages considerably; compare timings only between
+    # runs made with the same trace_memory setting
+    instrumentation.reset()
+    peak_memory = None
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        with instrumentation.stage(stage), contextlib.redirect_stdout(io.StringIO()):
+            function()
+        if trace_memory:
+            _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+
+    record = instrumentation.report()[stage]
+    results.append({
+        "scale": scale,
+        "stage": stage,
+        "seconds": round(record["seconds"], 6),
+        "statements": record["statements"],
+        "rows": record["rows_fetched"] + record["rows_affected"],
+        "rows_fetched": record["rows_fetched"],
+        "rows_affected": record["rows_affected"],
+        "peak_memory_bytes": peak_memory,
+    })
+    memory = f", {peak_memory / 2 ** 20:.1f} MiB peak" if trace_memory else ""
+    print(f"[{scale}] {stage}: {record['seconds']:.3f}s, {record['statements']} statements, "
+          f"{results[-1]['rows']} rows{memory}")
+
+
+def _sample_queries(session, n_queries, seed):
+    # Keyed queries on existing nv1 pairs plus random (mostly empty) ones
+    pairs = session.execute(text("SELECT aid1, aid2 FROM nv1 ORDER BY aid1, aid2")).fetchall()
+    rng = random.Random(seed)
+    max_aid = session.execute(text("SELECT COALESCE(MAX(aid), 1) FROM author")).scalar()
+    queries = []
+    for _ in range(n_queries):
+        if pairs and rng.random() < 0.5:
+            aid1, aid2 = rng.choice(pairs)
+        else:
+            aid1, aid2 = rng.randint(1, max_aid), rng.randint(1, max_aid)
+        queries.append(eq("aid1", aid1) & eq("aid2", aid2))
+    return queries
+
+
+def _reset_nv_tables(session):
+    create_nv_tables(session=session)
+    for statement in truncate_sql(session, NV_SOURCES):
+        session.execute(text(statement))
+    session.commit()
+
+
+def run_benchmark(scales=DEFAULT_SCALES, n_queries=100, seed=42, trace_memory=True):
+    create_tables()
+    was_enabled = instrumentation.enabled
+    instrumentation.enable()
+    # The query stages measure evaluation, so repeated sample queries must not hit the result cache
+    cache_bytes, RESULT_CACHE.max_bytes = RESULT_CACHE.max_bytes, 0
+    try:
+        results = []
+        measure = functools.partial(_measure, results=results, trace_memory=trace_memory)
+        for scale in scales:
+            measure("generate", scale, lambda: generate_dblp_like(GeneratorConfig.scaled(scale, seed=seed)))
+            measure("create_view_v1", scale, create_view_v1)
+            measure("create_view_v2", scale, create_view_v2)
+            measure("create_view_v3", scale, create_view_v3)
+            with Session() as session:
+                _reset_nv_tables(session)
+            measure("populate_nv_tables", scale, populate_nv_tables)
+            measure("transform_mvdb_to_indb", scale, transform_mvdb_to_indb)
+
+            # The queries of a scale share one session, like a client issuing them one after another
+            with Session() as session:
+                queries = _sample_queries(session, n_queries, seed)
+                measure("compute_PQ", scale, lambda: [compute_PQ(session, query) for query in queries])
+                measure("m_compute_PQ", scale, lambda: [m_compute_PQ(session, query) for query in queries])
+    finally:
+        if not was_enabled:
+            instrumentation.disable()
+        RESULT_CACHE.max_bytes = cache_bytes
+    return {
+        "meta": {
+            "created": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "queries_per_scale": n_queries,
+            "seed": seed,
+            "trace_memory": trace_memory,
+        },
+        "results": results,
+    }
+
+
+def compare_with_baseline(report, baseline, threshold=REGRESSION_THRESHOLD):
+    # Print the time ratio of every (scale, stage) against the baseline; returns the regressions
+    previous = {(row["scale"], row["stage"]): row for row in baseline["results"]}
+    regressions = []
+    print(f"{'scale':>10} {'stage':<24} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for row in report["results"]:
+        old = previous.get((row["scale"], row["stage"]))
+        if old is None:
+            continue
+        ratio = row["seconds"] / old["seconds"] if old["seconds"] else float("inf")
+        flag = ""
+        if ratio > threshold:
+            regressions.append((row["scale"], row["stage"], ratio))
+            flag = "  SLOWER"
+        elif ratio < 1 / threshold:
+            flag = "  faster"
+        print(f"{row['scale']:>10} {row['stage']:<24} {old['seconds']:>10.3f} {row['seconds']:>10.3f} {ratio:>7.2f}{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the MarkoViews pipeline")
+    parser.add_argument("--scales", type=int, nargs="+", default=list(DEFAULT_SCALES),
+                        help="approximate numbers of wrote tuples to benchmark")
+    parser.add_argument("--queries", type=int, default=100, help="probability queries per scale")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="bench_results.json", help="where to write the results")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument("--no-memory", action="store_true", help="do not trace peak memory (faster, steadier timings)")
+    args = parser.parse_args()
+
+    benchmark_report = run_benchmark(args.scales, args.queries, args.seed, trace_memory=not args.no_memory)
+    with open(args.output, "w") as output:
+        json.dump(benchmark_report, output, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            found = compare_with_baseline(benchmark_report, json.load(baseline_file), args.threshold)
+        if found:
+            print(f"{len(found)} stage(s) slower than the baseline by more than {args.threshold}x")
+            sys.exit(1)
@@ -0,0 +1,225 @@
+import math
+
+import numpy as np
+from sqlalchemy import text
+
+from app.models import session_scope
+from app.instrumentation import instrumented
+from app.predicates import Predicate
+from app.views import EPSILON, NV_SOURCES, get_nv_version, _PQ, _m_PQ
+
+# In-memory columnar copy of the INDB for hot read-only workloads.
+#
+# The NV tables are loaded once into NumPy arrays (one per key column, sorted by the table
+# keys, i.e. by (aid1, aid2, ...)) together with the per-tuple terms of the SQL aggregate:
+# log|1 - w_0|, whether 1 - w_0 is negative and whether w_0 = 1, for the plain and the clamped
+# (m_) variants. P0 over a set of tuples is then a vectorized sum of logs, as in
+# _log_aggregates_sql. Equality predicates and batches of keys are answered by binary search
+# over the sorted composite keys of the columns they use plus prefix sums, range predicates
+# by a vectorized scan:
+#
+#     indb = ColumnarINDB(session)
+#     indb.compute_PQ(eq("aid1", 1) & eq("aid2", 2))
+#
+# The results match compute_PQ & co. up to floating point summation order. The copy is a
+# snapshot of one NV version; refresh() reloads it after the NV tables changed. Only Predicate
+# queries are supported, raw SQL conditions need the database.
+
+CLAMPS = (None, EPSILON)
+MAX_PACKED_CODES = 2 ** 63  # Key combinations that fit one int64 composite code
+
+
+def _aggregate_terms(w_0, clamp):
+    # Per-tuple (log_abs, negative, zero) following _log_aggregates_sql; NULL w_0 (NaN)
+    # contributes nothing
+    known = ~np.isnan(w_0)
+    zero = known & (w_0 == 1)
+    counted = known & ~zero
+    factor = 1 - (w_0 if clamp is None else np.clip(w_0, clamp, 1 - clamp))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_abs = np.where(counted, np.log(np.abs(factor)), 0.0)
+    return log_abs, counted & (factor < 0), zero
+
+
+def _complement(log_abs, n_negative, n_zero):
+    # Vectorized _complement_from_log
+    with np.errstate(over="ignore"):
+        product = np.exp(log_abs)
+    sign = np.where(n_negative % 2 == 1, -1.0, 1.0)
+    return np.where(n_zero > 0, 1.0, 1 - sign * product)
+
+
+class _KeyIndex:
+    # The tuples of one table sorted by a composite code over some key columns, with prefix
+    # sums of the aggregate terms so any run of equal keys is summed in O(1)
+    def __init__(self, table, columns):
+        self.uniques = [np.unique(table.columns[column]) for column in columns]
+        self.packed = math.prod(len(unique) for unique in self.uniques) <= MAX_PACKED_CODES
+        codes = self._encode([table.columns[column] for column in columns])[0]
+        order = np.argsort(codes, kind="stable")
+        self.codes = codes[order]
+        self.sums = {}
+        for clamp, terms in table.terms.items():
+            self.sums[clamp] = [np.concatenate([[0], np.cumsum(term[order])]) for term in terms]
+
+    def _encode(self, values):
+        # Dense order-preserving code per column, combined into one int64 or, when that could
+        # overflow, into a record compared column by column; also returns which rows only use
+        # known values
+        positions = []
+        found = np.ones(len(values[0]), dtype=bool)
+        for unique, column in zip(self.uniques, values):
+            position = np.searchsorted(unique, column)
+            inside = position < len(unique)
+            found &= inside
+            found[inside] &= unique[position[inside]] == column[inside]
+            positions.append(np.minimum(position, len(unique) - 1))
+        if self.packed:
+            codes = np.zeros(len(values[0]), dtype=np.int64)
+            for unique, position in zip(self.uniques, positions):
+                codes = codes * len(unique) + position
+        else:
+            codes = np.empty(len(values[0]), dtype=[(f"c{i}", np.int64) for i in range(len(positions))])
+            for i, position in enumerate(positions):
+                codes[f"c{i}"] = position
+        return codes, found
+
+    def lookup(self, values, clamp):
+        # Summed (log_abs, negative, zero) of the tuples matching each key
+        codes, found = self._encode(values)
+        low = np.searchsorted(self.codes, codes, side="left")
+        high = np.where(found, np.searchsorted(self.codes, codes, side="right"), low)
+        return [sums[high] - sums[low] for sums in self.sums[clamp]]
+
+
+class _ColumnarTable:
+    def __init__(self, keys, rows):
+        self.keys = keys
+        columns = list(zip(*rows)) or [()] * (len(keys) + 1)
+        self.columns = {key: np.array(values, dtype=str if key == "inst" else np.int64)
+                        for key, values in zip(keys, columns)}
+        w_0 = np.array([np.nan if value is None else value for value in columns[-1]], dtype=np.float64)
+        self.terms = {clamp: _aggregate_terms(w_0, clamp) for clamp in CLAMPS}
+        self.totals = {clamp: [term.sum() for term in terms] for clamp, terms in self.terms.items()}
+        self._indexes = {}
+
+    def __len__(self):
+        return len(self.terms[None][0])
+
+    def index(self, columns):
+        if columns not in self._indexes:
+            self._indexes[columns] = _KeyIndex(self, columns)
+        return self._indexes[columns]
+
+    def scan(self, query, clamp):
+        # Summed aggregate terms of the tuples satisfying a Predicate with range terms
+        mask = np.ones(len(self), dtype=bool)
+        for column, op, values in query.terms:
+            column = self.columns[column]
+            if op == "=":
+                mask &= column == values[0]
+            elif op == "<":
+                mask &= column < values[0]
+            elif op == "<=":
+                mask &= column <= values[0]
+            elif op == ">":
+                mask &= column > values[0]
+            elif op == ">=":
+                mask &= column >= values[0]
+            else:
+                mask &= (column >= values[0]) & (column <= values[1])
+        return [term[mask].sum() for term in self.terms[clamp]]
+
+
+class ColumnarINDB:
+    def __init__(self, session=None):
+        self.tables = {}
+        self.version = None
+        self.load(session)
+
+    @instrumented(name="columnar_load")
+    def load(self, session=None):
+        # Snapshot nv1/nv2/nv3 and the NV version they belong to, in one transaction
+        with session_scope(session) as session:
+            version = get_nv_version(session)
+            tables = {}
+            for nv_table, (_, keys) in NV_SOURCES.items():
+                columns = ", ".join(keys)
+                rows = session.execute(text(f"SELECT {columns}, w_0 FROM {nv_table} ORDER BY {columns}")).all()
+                tables[nv_table] = _ColumnarTable(keys, rows)
+        self.tables, self.version = tables, version
+        print(f"Columnar INDB loaded at NV version {version}: "
+              + ", ".join(f"{nv_table} {len(table)} tuples" for nv_table, table in tables.items()))
+
+    def is_current(self, session=None):
+        with session_scope(session) as session:
+            return get_nv_version(session) == self.version
+
+    def refresh(self, session=None):
+        # Reload if the NV tables changed since the snapshot; returns whether it did
+        with session_scope(session) as session:
+            if get_nv_version(session) == self.version:
+                return False
+            self.load(session)
+        return True
+
+    def _P0(self, query, clamp):
+        if not isinstance(query, Predicate):
+            raise ValueError("The columnar INDB only evaluates Predicate queries")
+        totals = np.zeros(3)
+        equalities = tuple(sorted(column for column, op, _ in query.terms if op == "="))
+        for table in self.tables.values():
+            if not query.applies_to(table.keys):
+                continue
+            if query.terms and all(op == "=" for _, op, _ in query.terms) and len(set(equalities)) == len(equalities):
+                constants = {column: values[0] for column, _, values in query.terms}
+                sums = table.index(equalities).lookup(
+                    [np.array([constants[column]]) for column in equalities], clamp)
+                totals += [total[0] for total in sums]
+            elif query.terms:
+                totals += table.scan(query, clamp)
+            else:
+                totals += table.totals[clamp]
+        return float(_complement(*totals))
+
+    def compute_P0_Q_or_W(self, query):
+        return self._P0(query, None)
+
+    def compute_P0_W(self):
+        return self._P0(Predicate(), None)
+
+    def compute_PQ(self, query):
+        return _PQ(self.compute_P0_Q_or_W(query), self.compute_P0_W())
+
+    def m_compute_P0_Q_or_W(self, query):
+        return self._P0(query, EPSILON)
+
+    def m_compute_P0_W(self):
+        return self._P0(Predicate(), EPSILON)
+
+    def m_compute_PQ(self, query):
+        return _m_PQ(self.m_compute_P0_Q_or_W(query), self.m_compute_P0_W())
+
+    def _batch_P0_Q_or_W(self, keys, columns, clamp):
+        keys = list(keys)
+        columns = tuple(columns)
+        totals = [np.zeros(len(keys)), np.zeros(len(keys), dtype=np.int64), np.zeros(len(keys), dtype=np.int64)]
+        if keys:
+            for table in self.tables.values():
+                if not set(columns) <= set(table.keys):
+                    continue
+                values = [np.array([key[i] for key in keys]) for i in range(len(columns))]
+                for total, sums in zip(totals, table.index(columns).lookup(values, clamp)):
+                    total += sums
+        return keys, _complement(*totals)
+
+    def compute_PQ_batch(self, keys, columns=("aid1", "aid2")):
+        # Same as app.views.compute_PQ_batch, as a list of (key, probability) in input order
+        P0_W = self.compute_P0_W()
+        keys, P0_Q_or_W = self._batch_P0_Q_or_W(keys, columns, None)
+        return [(tuple(key), _PQ(float(value), P0_W)) for key, value in zip(keys, P0_Q_or_W)]
+
+    def m_compute_PQ_batch(self, keys, columns=("aid1", "aid2")):
+        m_P0_W = self.m_compute_P0_W()
+        keys, m_P0_Q_or_W = self._batch_P0_Q_or_W(keys, columns, EPSILON)
+        return [(tuple(key), _m_PQ(float(value), m_P0_W)) for key, value in zip(keys, m_P0_Q_or_W)]
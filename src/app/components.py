@@ -0,0 +1,277 @@
+import math
+
+from sqlalchemy import text, inspect, Table, Column, Integer, BigInteger, Float, MetaData, Index
+
+from app.models import session_scope
+from app.instrumentation import instrumented
+from app.views import MARKOVIEWS, PROBABILISTIC_TABLES, get_nv_version
+from app.dialects import any_sql, bind_arrays
+from app.lineage import MAX_LINEAGE_CLAUSES, Lineage, LineageTooLarge, absorb, add_query_clauses, condition_certain, \
+    exact_compute_PQ, fetch_base_probabilities, group_by_table, independent_parts, is_hierarchical, \
+    lineage_probability, none_probability, nv_body, query_nv_tables, safe_plan, touching_nv_rows, tuple_params, \
+    tuples_sql
+
+# Connected components of the MarkoView constraints W.
+#
+# Two NV tuples are connected when their bodies share a probabilistic base tuple (an advisorp
+# or studentp tuple), and clauses of W in different components are independent, so P(Q) only
+# depends on the components Q's base tuples belong to. The component index stores, per base
+# tuple, its component (mv_component_advisorp, mv_component_studentp, ...), and per component
+# its number of clauses and P0(not W_C) (mv_component), computed once with the compiled
+# lineage of app.lineage. component_compute_PQ then finds Q's components with keyed lookups,
+# fetches their NV tuples with one join per view and reuses the cached P0(not W_C), so its
+# cost depends on the size of those components and not on the size of the database.
+#
+# The index belongs to one NV version. refresh_nv_incremental() updates it in place: only
+# the components around the touched authors are relabelled and recomputed. After any other
+# change to the NV tables (populate_nv_tables, parallel or partition rebuilds)
+# component_compute_PQ falls back to exact_compute_PQ until build_component_index() is run.
+
+COMPONENT_TABLE = "mv_component"
+STATE_TABLE = "mv_component_state"
+
+
+def _map_table(table):
+    return f"mv_component_{table}"
+
+
+def _index_metadata():
+    metadata = MetaData()
+    for table, columns in PROBABILISTIC_TABLES.items():
+        Table(_map_table(table), metadata,
+              *(Column(column, BigInteger, primary_key=True) for column in columns),
+              Column("component", BigInteger),
+              Index(f"ix_{_map_table(table)}_component", "component"))
+    Table(COMPONENT_TABLE, metadata,
+          Column("component", BigInteger, primary_key=True),
+          Column("n_clauses", Integer),
+          Column("none_w", Float))  # P0(not W_C); NULL if the component is too large to compile
+    Table(STATE_TABLE, metadata,
+          Column("id", Integer, primary_key=True),
+          Column("nv_version", Integer))  # NV version the index was built for
+    return metadata
+
+
+def component_index_exists(session):
+    return inspect(session.connection()).has_table(STATE_TABLE)
+
+
+def component_index_current(session):
+    if not component_index_exists(session):
+        return False
+    version = session.execute(text(f"SELECT nv_version FROM {STATE_TABLE} WHERE id = 1")).scalar()
+    return version is not None and version == get_nv_version(session)
+
+
+def _set_index_version(session):
+    session.execute(text(f"DELETE FROM {STATE_TABLE}"))
+    session.execute(text(f"INSERT INTO {STATE_TABLE} (id, nv_version) VALUES (1, :version)"),
+                    {"version": get_nv_version(session)})
+
+
+def _write_components(session, clauses, max_clauses):
+    # Group the clauses ({nv_variable: (weight, body)}) into components, store them under new
+    # ids with their P0(not W_C) and return the number of components
+    lineage = Lineage()
+    for nv_variable, (weight, body) in clauses.items():
+        lineage.probabilities[nv_variable] = 1 - weight
+        lineage.constraint.add(frozenset(body | {nv_variable}))
+    fetch_base_probabilities(session, lineage)
+
+    # Components are taken on the clauses as they are, before the certain variables are
+    # substituted: substitution and absorption can move a clause out of the part its tuples
+    # belong to, and the breadth-first component of exact_compute_PQ is unconditioned too
+    probabilities = lineage.probabilities
+    first_id = session.execute(text(f"SELECT COALESCE(MAX(component), 0) + 1 FROM {COMPONENT_TABLE}")).scalar()
+    mappings = {table: [] for table in PROBABILISTIC_TABLES}
+    components = []
+    for component, part in enumerate(independent_parts(list(lineage.constraint)), start=first_id):
+        for variable in set().union(*part):
+            if variable[0] in PROBABILISTIC_TABLES:
+                mappings[variable[0]].append(dict(zip(PROBABILISTIC_TABLES[variable[0]], variable[1:]),
+                                                  component=component))
+        none_w = None
+        if len(part) <= max_clauses:
+            none_w = none_probability(condition_certain(part, probabilities), probabilities, {})
+        components.append({"component": component, "n_clauses": len(part), "none_w": none_w})
+    for table, rows in mappings.items():
+        if rows:
+            columns = PROBABILISTIC_TABLES[table] + ("component",)
+            session.execute(text(f"INSERT INTO {_map_table(table)} ({', '.join(columns)}) "
+                                 f"VALUES ({', '.join(':' + column for column in columns)})"), rows)
+    if components:
+        session.execute(text(f"INSERT INTO {COMPONENT_TABLE} (component, n_clauses, none_w) "
+                             f"VALUES (:component, :n_clauses, :none_w)"), components)
+    return len(components)
+
+
+def _all_clauses(session):
+    clauses = {}
+    for view in MARKOVIEWS.values():
+        if not view.atoms:
+            continue
+        keys = view.key_columns
+        for row in session.execute(text(f"SELECT {', '.join(keys)}, weight FROM {view.nv_table}")):
+            key = tuple(row[:len(keys)])
+            clauses[(view.nv_table,) + key] = (row.weight, nv_body(view.nv_table, key))
+    return clauses
+
+
+@instrumented
+def build_component_index(session=None, max_clauses=MAX_LINEAGE_CLAUSES):
+    # (Re)build the component index for the current NV tables; returns the number of components
+    with session_scope(session) as session:
+        try:
+            metadata = _index_metadata()
+            metadata.create_all(session.connection())
+            for table in metadata.sorted_tables:
+                session.execute(text(f"DELETE FROM {table.name}"))
+            count = _write_components(session, _all_clauses(session), max_clauses)
+            _set_index_version(session)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+    print(f"Component index built: {count} components.")
+    return count
+
+
+def _components_of(session, base_tuples):
+    # Component ids of the given base tuples ({table: [key, ...]}); tuples without one are in no clause
+    params = bind_arrays(session, tuple_params(base_tuples))
+    components = set()
+    for table, keys in base_tuples.items():
+        columns = PROBABILISTIC_TABLES[table]
+        result = session.execute(text(f"""
+            SELECT DISTINCT component FROM {_map_table(table)}
+            WHERE {tuples_sql(session, table, columns)}
+        """), params)
+        components.update(row.component for row in result)
+    return components
+
+
+def _closure(session, variables):
+    # Every NV clause connected to the given base tuples: {nv_variable: (weight, body)}
+    clauses, seen = {}, set()
+    frontier = set(variables)
+    while frontier:
+        seen |= frontier
+        base_tuples = group_by_table(frontier)
+        frontier = set()
+        for nv_table, key, weight in touching_nv_rows(session, base_tuples):
+            nv_variable = (nv_table,) + key
+            if nv_variable not in clauses:
+                body = nv_body(nv_table, key)
+                clauses[nv_variable] = (weight, body)
+                frontier |= body - seen
+    return clauses
+
+
+def _component_variables(session, components):
+    variables = set()
+    params = bind_arrays(session, {"components": sorted(components)})
+    for table, columns in PROBABILISTIC_TABLES.items():
+        result = session.execute(text(f"""
+            SELECT {', '.join(columns)} FROM {_map_table(table)}
+            WHERE {any_sql(session, 'component', 'components')}
+        """), params)
+        variables.update((table,) + tuple(row) for row in result)
+    return variables
+
+
+def update_component_index(session, aids, max_clauses=MAX_LINEAGE_CLAUSES):
+    # Relabel the components around the NV tuples of the given authors after their NV rows
+    # changed (called by refresh_nv_incremental in its transaction). The old components of
+    # their base tuples are dropped and the components now connected to those tuples are
+    # stored afresh; the rest of the index is untouched. Returns the number of new components
+    params = bind_arrays(session, {"aids": sorted(aids)})
+    stale, seeds = set(), set()
+    for table, columns in PROBABILISTIC_TABLES.items():
+        condition = " OR ".join(any_sql(session, column, "aids") for column in columns)
+        result = session.execute(text(f"SELECT DISTINCT component FROM {_map_table(table)} WHERE {condition}"),
+                                 params)
+        stale.update(row.component for row in result)
+        result = session.execute(text(f"SELECT {', '.join(columns)} FROM {table} WHERE {condition}"), params)
+        seeds.update((table,) + tuple(row) for row in result)
+    seeds |= _component_variables(session, stale)
+    clauses = _closure(session, seeds)
+    # Components merged into the new ones through the closure are replaced as well
+    reached = set().union(*(body for _, body in clauses.values())) if clauses else set()
+    stale |= _components_of(session, group_by_table(reached))
+
+    stale_params = bind_arrays(session, {"components": sorted(stale)})
+    for name in [_map_table(table) for table in PROBABILISTIC_TABLES] + [COMPONENT_TABLE]:
+        session.execute(text(f"DELETE FROM {name} WHERE {any_sql(session, 'component', 'components')}"),
+                        stale_params)
+    count = _write_components(session, clauses, max_clauses)
+    _set_index_version(session)
+    return count
+
+
+def _index_lineage(session, query, views, max_clauses):
+    # Lineage of the query and of the components it touches, read from the index, and the
+    # cached P0(not W_C) of those components
+    lineage = Lineage()
+    add_query_clauses(session, lineage, query, query_nv_tables(query, views))
+    components = _components_of(session, group_by_table(lineage.variables()))
+    if not components:
+        fetch_base_probabilities(session, lineage)
+        return lineage, []
+    params = bind_arrays(session, {"components": sorted(components)})
+    rows = session.execute(text(f"""
+        SELECT n_clauses, none_w FROM {COMPONENT_TABLE}
+        WHERE {any_sql(session, 'component', 'components')}
+    """), params).all()
+    if sum(row.n_clauses for row in rows) > max_clauses:
+        raise LineageTooLarge(f"The lineage component exceeds {max_clauses} clauses")
+    for view in MARKOVIEWS.values():
+        if not view.atoms:
+            continue
+        # All base tuples of an NV tuple are in its component, so its first atom finds it
+        table, columns = view.atoms[0]
+        join_sql = " AND ".join(f"c.{map_column} = n.{column}"
+                                for map_column, column in zip(PROBABILISTIC_TABLES[table], columns))
+        keys = view.key_columns
+        result = session.execute(text(f"""
+            SELECT {', '.join('n.' + key for key in keys)}, n.weight FROM {view.nv_table} n
+            JOIN {_map_table(table)} c ON {join_sql}
+            WHERE {any_sql(session, 'c.component', 'components')}
+        """), params)
+        for row in result:
+            key = tuple(row[:len(keys)])
+            nv_variable = (view.nv_table,) + key
+            lineage.probabilities[nv_variable] = 1 - row.weight
+            lineage.constraint.add(frozenset(nv_body(view.nv_table, key) | {nv_variable}))
+    fetch_base_probabilities(session, lineage)
+    return lineage, [row.none_w for row in rows]
+
+
+@instrumented
+def component_compute_PQ(session, query, views=None, max_clauses=MAX_LINEAGE_CLAUSES):
+    # exact_compute_PQ through the component index; falls back to exact_compute_PQ when the
+    # index is missing or was built for other NV data
+    with session_scope(session) as session:
+        if not component_index_current(session):
+            return exact_compute_PQ(session, query, views, max_clauses)
+        lineage, cached = _index_lineage(session, query, views, max_clauses)
+        if not lineage.query:
+            return 0.0
+        if not lineage.constraint:
+            return lineage_probability(lineage.query, lineage.probabilities)
+        if is_hierarchical(lineage):
+            return safe_plan(session, query)
+
+    # P(Q | not W_C) over the whole components: the parts of W_C that share nothing with Q
+    # cancel out of the ratio, as in conditional_probability, and P0(not W_C) is cached
+    probabilities = lineage.probabilities
+    query_clauses = condition_certain(lineage.query, probabilities)
+    constraint = condition_certain(lineage.constraint, probabilities)
+    if frozenset() in constraint:
+        raise ValueError("The MarkoView constraints hold in every world; P(Q) is undefined")
+    memo = {}
+    if None in cached:
+        none_w = none_probability(constraint, probabilities, memo)
+    else:
+        none_w = math.prod(cached)
+    none_q_or_w = none_probability(absorb(query_clauses | constraint), probabilities, memo)
+    return 1 - none_q_or_w / none_w
@@ -0,0 +1,124 @@
+import hashlib
+
+from lxml import etree
+
+from app.models import engine, copy_rows
+from app.instrumentation import instrumented
+from app.dialects import dialect_name
+
+# Streaming loader for the DBLP XML dump (https://dblp.org/xml/).
+#
+# The dump is parsed incrementally with iterparse and every record is cleared as soon as it
+# has been read, so memory stays bounded by the batch size rather than the file size. dblp.xml
+# declares its character entities in dblp.dtd, which has to sit next to the XML file. Rows are
+# COPYed into unlogged staging tables one batch at a time and merged into author, pub and
+# wrote with a set-based INSERT ... ON CONFLICT, so re-running the load is safe. The loader
+# relies on COPY and DISTINCT ON and therefore needs PostgreSQL.
+
+PUBLICATION_TAGS = ("article", "inproceedings", "proceedings", "book", "incollection", "phdthesis", "mastersthesis")
+
+STAGING_TABLES = {
+    "dblp_author": ("aid", "name"),
+    "dblp_pub": ("pid", "year"),
+    "dblp_wrote": ("aid", "pid"),
+}
+
+MERGE_SQL = [
+    """INSERT INTO author (aid, name)
+       SELECT DISTINCT ON (aid) aid, name FROM dblp_author
+       ON CONFLICT (aid) DO NOTHING""",
+    """INSERT INTO pub (pid, year)
+       SELECT DISTINCT ON (pid) pid, year FROM dblp_pub
+       ON CONFLICT (pid) DO UPDATE SET year = EXCLUDED.year""",
+    """INSERT INTO wrote (aid, pid)
+       SELECT DISTINCT aid, pid FROM dblp_wrote
+       ON CONFLICT (aid, pid) DO NOTHING""",
+]
+
+
+def stable_id(key):
+    # 63-bit id from a BLAKE2b digest of the DBLP author name or record key. Unlike hash() it is
+    # the same in every process and every run, so ids survive re-loads of newer dumps
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big") >> 1
+
+
+def iter_publications(dblp_file_path):
+    # Yields (key, year, [author names]) for every publication record of the dump
+    context = etree.iterparse(
+        dblp_file_path, events=("end",), tag=PUBLICATION_TAGS,
+        load_dtd=True, resolve_entities=True, huge_tree=True, recover=True
+    )
+    for _, element in context:
+        year = element.findtext("year")
+        authors = ["".join(author.itertext()).strip() for author in element.iterfind("author")]
+        yield element.get("key"), int(year) if year and year.isdigit() else None, [a for a in authors if a]
+
+        # Free the record and everything parsed before it (including skipped records such as www)
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+
+def _flush(dbapi_connection, batch):
+    with dbapi_connection.cursor() as cursor:
+        for table in STAGING_TABLES:
+            cursor.execute(f"TRUNCATE {table}")
+    for table, columns in STAGING_TABLES.items():
+        copy_rows(dbapi_connection, table, columns, batch[table])
+    with dbapi_connection.cursor() as cursor:
+        for merge_sql in MERGE_SQL:
+            cursor.execute(merge_sql)
+    dbapi_connection.commit()
+
+
+@instrumented
+def load_dblp(dblp_file_path, batch_size=50000):
+    # Load author, pub and wrote from the DBLP dump, committing every batch_size publications.
+    # Returns the number of publications and author links read from the file
+    if dialect_name(engine) != "postgresql":
+        raise RuntimeError("load_dblp requires PostgreSQL")
+    dbapi_connection = engine.raw_connection()
+    try:
+        with dbapi_connection.cursor() as cursor:
+            cursor.execute("CREATE UNLOGGED TABLE IF NOT EXISTS dblp_author (aid BIGINT, name VARCHAR)")
+            cursor.execute("CREATE UNLOGGED TABLE IF NOT EXISTS dblp_pub (pid BIGINT, year INTEGER)")
+            cursor.execute("CREATE UNLOGGED TABLE IF NOT EXISTS dblp_wrote (aid BIGINT, pid BIGINT)")
+        dbapi_connection.commit()
+
+        batch = {table: [] for table in STAGING_TABLES}
+        authors_in_batch = set()
+        n_publications = n_links = 0
+        for key, year, authors in iter_publications(dblp_file_path):
+            pid = stable_id(key)
+            batch["dblp_pub"].append((pid, year))
+            for name in authors:
+                aid = stable_id(name)
+                if aid not in authors_in_batch:
+                    authors_in_batch.add(aid)
+                    batch["dblp_author"].append((aid, name))
+                batch["dblp_wrote"].append((aid, pid))
+            n_publications += 1
+            n_links += len(authors)
+
+            if len(batch["dblp_pub"]) >= batch_size:
+                _flush(dbapi_connection, batch)
+                batch = {table: [] for table in STAGING_TABLES}
+                authors_in_batch.clear()
+                print(f"Loaded {n_publications} publications...")
+        _flush(dbapi_connection, batch)
+
+        with dbapi_connection.cursor() as cursor:
+            for table in STAGING_TABLES:
+                cursor.execute(f"DROP TABLE {table}")
+            cursor.execute("ANALYZE author")
+            cursor.execute("ANALYZE pub")
+            cursor.execute("ANALYZE wrote")
+        dbapi_connection.commit()
+    except Exception:
+        dbapi_connection.rollback()
+        raise
+    finally:
+        dbapi_connection.close()
+
+    print(f"DBLP load complete: {n_publications} publications, {n_links} author links.")
+    return n_publications, n_links
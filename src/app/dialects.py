@@ -0,0 +1,72 @@
+import json
+
+# SQL fragments that differ between the supported backends, PostgreSQL and SQLite.
+#
+# Everything else in the pipeline is written in the SQL both understand. The differences are
+# array parameters (PostgreSQL binds Python lists as arrays; on SQLite they are bound as JSON
+# text and expanded with json_each), TRUNCATE, which SQLite does not have, and the null-safe
+# IS DISTINCT FROM, which SQLite only has from 3.39. `bind` is a session, connection or engine.
+
+
+def dialect_name(bind):
+    if hasattr(bind, "get_bind"):
+        bind = bind.get_bind()
+    return bind.dialect.name
+
+
+def database_key(bind):
+    # Identity of the database behind a session, connection or engine, for caches of query
+    # results: its URL without the driver, so the synchronous and the asyncpg engines of one
+    # database share it, except for in-memory SQLite, where every engine is its own database
+    # under the same URL
+    if hasattr(bind, "get_bind"):
+        bind = bind.get_bind()
+    engine = getattr(bind, "engine", bind)
+    url = engine.url
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return id(engine)
+    return url.set(drivername=url.get_backend_name()).render_as_string(hide_password=True)
+
+
+def is_sqlite(bind):
+    return dialect_name(bind) == "sqlite"
+
+
+def any_sql(bind, expression, name, sql_type="BIGINT"):
+    # Condition: expression equals one element of the list bound to :name
+    if is_sqlite(bind):
+        return f"{expression} IN (SELECT value FROM json_each(:{name}))"
+    return f"{expression} = ANY(CAST(:{name} AS {sql_type}[]))"
+
+
+def unnest_sql(bind, names, columns, sql_types):
+    # Subquery zipping the lists bound to :names into rows with the given column names
+    if is_sqlite(bind):
+        values = ", ".join(f"a{i}.value AS {column}" for i, column in enumerate(columns))
+        joins = "".join(f" JOIN json_each(:{name}) AS a{i} ON a{i}.key = a0.key"
+                        for i, name in enumerate(names) if i)
+        return f"SELECT {values} FROM json_each(:{names[0]}) AS a0{joins}"
+    arrays = ", ".join(f"CAST(:{name} AS {sql_type}[])" for name, sql_type in zip(names, sql_types))
+    return f"SELECT * FROM unnest({arrays}) AS k({', '.join(columns)})"
+
+
+def bind_arrays(bind, params):
+    # List parameters as the dialect expects them for any_sql / unnest_sql
+    if not is_sqlite(bind):
+        return params
+    return {name: json.dumps(list(value)) if isinstance(value, (list, tuple)) else value
+            for name, value in params.items()}
+
+
+def distinct_sql(bind, left, right):
+    # Null-safe inequality: true when exactly one side is NULL or both differ
+    if is_sqlite(bind):
+        return f"{left} IS NOT {right}"
+    return f"{left} IS DISTINCT FROM {right}"
+
+
+def truncate_sql(bind, tables):
+    # Statements emptying the tables
+    if is_sqlite(bind):
+        return [f"DELETE FROM {table}" for table in tables]
+    return [f"TRUNCATE {', '.join(tables)}"]
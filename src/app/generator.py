@@ -0,0 +1,198 @@
+import argparse
+import itertools
+import random
+from contextlib import closing
+
+from app.models import engine, copy_rows
+from app.instrumentation import instrumented
+from app.dialects import truncate_sql
+
+# Synthetic DBLP-like data for load testing the MarkoViews pipeline.
+#
+# Authors have Pareto-distributed productivity, papers have a geometric number of co-authors,
+# and a share of the papers is written by an advisor together with their student in the year
+# the student was a student, so V1, V2 and V3 all produce tuples at every scale. The same seed
+# always produces the same database. Rows are generated lazily and COPYed in batches.
+
+
+class GeneratorConfig:
+    def __init__(self, n_authors=1000, n_papers=5000, mean_authors_per_paper=3.0, productivity_skew=1.5,
+                 n_advisor_edges=200, max_advisors_per_student=2, advised_paper_fraction=0.2,
+                 year_range=(1995, 2023), n_institutions=50, same_institution_probability=0.8, seed=42):
+        if n_authors < 2:
+            raise ValueError("At least two authors are needed")
+        self.n_authors = n_authors
+        self.n_papers = n_papers
+        self.mean_authors_per_paper = mean_authors_per_paper
+        self.productivity_skew = productivity_skew
+        self.n_advisor_edges = n_advisor_edges
+        self.max_advisors_per_student = max_advisors_per_student
+        self.advised_paper_fraction = advised_paper_fraction
+        self.year_range = year_range
+        self.n_institutions = n_institutions
+        self.same_institution_probability = same_institution_probability
+        self.seed = seed
+
+    @classmethod
+    def scaled(cls, scale, seed=42):
+        # Preset with about `scale` wrote tuples (scale=10**4 ... 10**7)
+        n_papers = max(scale // 3, 10)
+        return cls(n_authors=max(n_papers // 4, 10), n_papers=n_papers,
+                   n_advisor_edges=max(n_papers // 20, 5), n_institutions=max(n_papers // 500, 5), seed=seed)
+
+
+def _geometric(rng, mean):
+    # Number of co-authors >= 1 with the given mean
+    p = 1.0 / mean
+    count = 1
+    while rng.random() > p:
+        count += 1
+    return count
+
+
+class _Dataset:
+    def __init__(self, config):
+        self.config = config
+        rng = random.Random(config.seed)
+        self.rng = rng
+        self.authors = range(1, config.n_authors + 1)
+
+        # Pareto productivity -> cumulative weights for rng.choices
+        weights = [rng.paretovariate(config.productivity_skew) for _ in self.authors]
+        self.cum_weights = list(itertools.accumulate(weights))
+
+        first_year, last_year = config.year_range
+        self.institution = {aid: rng.randrange(config.n_institutions) for aid in self.authors}
+
+        # Student -> (year, [advisors]); advisors are drawn from the productive authors
+        self.students = {}
+        n_edges = 0
+        while n_edges < config.n_advisor_edges and len(self.students) < config.n_authors - 1:
+            student = rng.choice(self.authors)
+            if student in self.students:
+                continue
+            # A student can have at most every other author as advisor
+            n_advisors = min(rng.randint(1, config.max_advisors_per_student), config.n_advisor_edges - n_edges,
+                             config.n_authors - 1)
+            advisors = set()
+            while len(advisors) < n_advisors:
+                advisor = rng.choices(self.authors, cum_weights=self.cum_weights)[0]
+                if advisor != student:
+                    advisors.add(advisor)
+            self.students[student] = (rng.randint(first_year, last_year), sorted(advisors))
+            n_edges += len(advisors)
+            if rng.random() < config.same_institution_probability:
+                self.institution[student] = self.institution[next(iter(advisors))]
+        self.edges = [(advisor, student) for student, (_, advisors) in self.students.items() for advisor in advisors]
+
+    def author_rows(self):
+        return ((aid, f"Author {aid}") for aid in self.authors)
+
+    def affiliation_rows(self):
+        return ((aid, f"Institution {inst}") for aid, inst in self.institution.items())
+
+    def studentp_rows(self):
+        return ((aid, year, round(self.rng.uniform(0.5, 1.0), 3)) for aid, (year, _) in self.students.items())
+
+    def advisorp_rows(self):
+        return ((advisor, student, round(self.rng.uniform(0.5, 1.0), 3)) for advisor, student in self.edges)
+
+    def paper_rows(self):
+        # Yields (pid, year, [aids]); uses its own RNG stream so papers do not depend on
+        # the order in which the other tables are consumed
+        config = self.config
+        rng = random.Random(config.seed + 1)
+        first_year, last_year = config.year_range
+        for pid in range(1, config.n_papers + 1):
+            n_authors = min(_geometric(rng, config.mean_authors_per_paper), config.n_authors)
+            if self.edges and rng.random() < config.advised_paper_fraction:
+                advisor, student = rng.choice(self.edges)
+                year = self.students[student][0]
+                aids = {advisor, student}
+            else:
+                year = rng.randint(first_year, last_year)
+                aids = set()
+            while len(aids) < n_authors:
+                aids.add(rng.choices(self.authors, cum_weights=self.cum_weights)[0])
+            yield pid, year, sorted(aids)
+
+
+def _batches(rows, batch_size):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+@instrumented
+def generate_dblp_like(config=None, batch_size=100000, bind=None):
+    # Replace the contents of the base tables with a synthetic dataset; returns row counts.
+    # bind: another engine than the configured one
+    config = config or GeneratorConfig()
+    dataset = _Dataset(config)
+    counts = {}
+    bind = bind or engine
+    dbapi_connection = bind.raw_connection()
+    try:
+        with closing(dbapi_connection.cursor()) as cursor:
+            for statement in truncate_sql(bind, ("wrote", "affiliation", "pub", "advisorp", "studentp", "author")):
+                cursor.execute(statement)
+
+        tables = [
+            ("author", ("aid", "name"), dataset.author_rows()),
+            ("affiliation", ("aid", "inst"), dataset.affiliation_rows()),
+            ("studentp", ("aid", "year", "probability"), dataset.studentp_rows()),
+            ("advisorp", ("aid1", "aid2", "probability"), dataset.advisorp_rows()),
+        ]
+        for table, columns, rows in tables:
+            counts[table] = 0
+            for batch in _batches(rows, batch_size):
+                copy_rows(dbapi_connection, table, columns, batch)
+                counts[table] += len(batch)
+
+        counts["pub"] = counts["wrote"] = 0
+        for papers in _batches(dataset.paper_rows(), batch_size):
+            copy_rows(dbapi_connection, "pub", ("pid", "year"), [(pid, year) for pid, year, _ in papers])
+            wrote = [(aid, pid) for pid, _, aids in papers for aid in aids]
+            copy_rows(dbapi_connection, "wrote", ("aid", "pid"), wrote)
+            counts["pub"] += len(papers)
+            counts["wrote"] += len(wrote)
+
+        with closing(dbapi_connection.cursor()) as cursor:
+            for table in counts:
+                cursor.execute(f"ANALYZE {table}")
+        dbapi_connection.commit()
+    except Exception:
+        dbapi_connection.rollback()
+        raise
+    finally:
+        dbapi_connection.close()
+
+    print(f"Synthetic data generated (seed {config.seed}): {counts}")
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic DBLP-like dataset")
+    parser.add_argument("--scale", type=int, help="approximate number of wrote tuples (overrides the sizes below)")
+    parser.add_argument("--authors", type=int, default=1000)
+    parser.add_argument("--papers", type=int, default=5000)
+    parser.add_argument("--authors-per-paper", type=float, default=3.0)
+    parser.add_argument("--advisor-edges", type=int, default=200)
+    parser.add_argument("--institutions", type=int, default=50)
+    parser.add_argument("--first-year", type=int, default=1995)
+    parser.add_argument("--last-year", type=int, default=2023)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if args.scale:
+        generator_config = GeneratorConfig.scaled(args.scale, seed=args.seed)
+    else:
+        generator_config = GeneratorConfig(
+            n_authors=args.authors, n_papers=args.papers, mean_authors_per_paper=args.authors_per_paper,
+            n_advisor_edges=args.advisor_edges, year_range=(args.first_year, args.last_year),
+            n_institutions=args.institutions, seed=args.seed
+        )
+    generate_dblp_like(generator_config)
@@ -0,0 +1,139 @@
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.models import session_scope, Author, Wrote, Studentp, Advisorp, Affiliation, Pub
+from app.instrumentation import instrumented
+from app.views import NV_SOURCES, VIEW_SQL, _relation_kind, _w0_sql, bump_nv_version
+from app.dialects import is_sqlite, any_sql, bind_arrays
+from app.components import component_index_current, update_component_index
+
+# Incremental maintenance of the NV tables.
+#
+# Every V1/V2/V3 group is keyed by a pair of authors (aid1, aid2), and every base tuple
+# that feeds a group belongs to one of those two authors (their wrote/studentp/affiliation
+# rows, the advisorp edge between them, or a pub they co-authored). A delta therefore only
+# affects the groups whose aid1 or aid2 is one of the authors touched by the delta; those
+# nv rows are deleted and recomputed from the view bodies restricted to the touched authors.
+# A component index that was current is updated around the same authors (app.components),
+# and MarkoViews created with materialized=True are brought up to date in the same transaction.
+
+BASE_MODELS = {
+    "author": Author,
+    "wrote": Wrote,
+    "pub": Pub,
+    "studentp": Studentp,
+    "advisorp": Advisorp,
+    "affiliation": Affiliation,
+}
+
+# Columns of each base table that identify an author touched by a delta row
+AUTHOR_COLUMNS = {
+    "wrote": ("aid",),
+    "studentp": ("aid",),
+    "advisorp": ("aid1", "aid2"),
+    "affiliation": ("aid",),
+}
+
+
+def _upsert(session, table_name, rows):
+    # Insert new rows and overwrite the non-key columns of existing ones
+    table = BASE_MODELS[table_name].__table__
+    keys = [column.name for column in table.primary_key]
+    statement = (sqlite if is_sqlite(session) else postgresql).insert(table)
+    updates = {column.name: statement.excluded[column.name] for column in table.columns if column.name not in keys}
+    if updates:
+        statement = statement.on_conflict_do_update(index_elements=keys, set_=updates)
+    else:
+        statement = statement.on_conflict_do_nothing(index_elements=keys)
+    session.execute(statement, rows)
+
+
+def _delete(session, table_name, rows):
+    table = BASE_MODELS[table_name].__table__
+    condition = " AND ".join(f"{column.name} = :{column.name}" for column in table.primary_key)
+    session.execute(text(f"DELETE FROM {table_name} WHERE {condition}"), rows)
+
+
+def _touched_authors(session, changes):
+    aids, pids = set(), set()
+    for table_name, rows in changes:
+        for row in rows:
+            aids.update(row[column] for column in AUTHOR_COLUMNS.get(table_name, ()))
+            if table_name == "pub":
+                pids.add(row["pid"])
+    # A changed publication (e.g. its year) affects every pair of its authors
+    if pids:
+        result = session.execute(
+            text(f"SELECT DISTINCT aid FROM wrote WHERE {any_sql(session, 'pid', 'pids')}"),
+            bind_arrays(session, {"pids": sorted(pids)})
+        )
+        aids.update(row.aid for row in result)
+    return sorted(aids)
+
+
+def _refresh_materialized(session, affected, params):
+    # The stored rows of materialized MarkoViews: on SQLite the groups of the touched authors
+    # are recomputed like the NV rows, PostgreSQL only refreshes a materialized view as a whole
+    for view in VIEW_SQL:
+        if _relation_kind(session, view) != "m":
+            continue
+        if is_sqlite(session):
+            session.execute(text(f"DELETE FROM {view} WHERE {affected}"), params)
+            session.execute(text(f"INSERT INTO {view} SELECT * FROM ({VIEW_SQL[view]}) AS v WHERE {affected}"),
+                            params)
+        else:
+            session.execute(text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view}"))
+
+
+@instrumented
+def refresh_nv_incremental(session, inserted=None, deleted=None):
+    # Apply base-table deltas and bring nv1/nv2/nv3 (weight and w_0) up to date by
+    # recomputing only the groups of the touched authors.
+    #   inserted / deleted: {"wrote": [{"aid": 1, "pid": 107}, ...], "pub": [...], ...}
+    # Inserted rows that already exist overwrite the stored values. Everything runs in one
+    # transaction (on a session of its own if session is None); returns per NV table the
+    # number of rows deleted and inserted.
+    inserted = inserted or {}
+    deleted = deleted or {}
+    unknown = (set(inserted) | set(deleted)) - set(BASE_MODELS)
+    if unknown:
+        raise ValueError(f"Unknown base tables in delta: {sorted(unknown)}")
+
+    with session_scope(session) as session:
+        try:
+            for table_name, rows in deleted.items():
+                if rows:
+                    _delete(session, table_name, rows)
+            for table_name, rows in inserted.items():
+                if rows:
+                    _upsert(session, table_name, rows)
+
+            index_current = component_index_current(session)
+            aids = _touched_authors(session, list(inserted.items()) + list(deleted.items()))
+            counts = {}
+            params = bind_arrays(session, {"aids": aids})
+            affected = f"{any_sql(session, 'aid1', 'aids')} OR {any_sql(session, 'aid2', 'aids')}"
+            for nv_table, (view, keys) in NV_SOURCES.items():
+                removed = session.execute(text(f"DELETE FROM {nv_table} WHERE {affected}"), params)
+                columns = ", ".join(keys + ("weight",))
+                added = session.execute(text(f"""
+                    INSERT INTO {nv_table} ({columns}, w_0)
+                    SELECT {columns}, {_w0_sql("CAST(weight AS FLOAT)")}
+                    FROM ({VIEW_SQL[view]}) AS v
+                    WHERE {affected}
+                    ON CONFLICT DO NOTHING
+                """), params)
+                counts[nv_table] = {"deleted": removed.rowcount, "inserted": added.rowcount}
+
+            if any(count["deleted"] or count["inserted"] for count in counts.values()):
+                bump_nv_version(session)
+                if index_current:
+                    update_component_index(session, aids)
+                _refresh_materialized(session, affected, params)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+
+    print(f"Incremental refresh over {len(aids)} touched authors: {counts}")
+    return counts
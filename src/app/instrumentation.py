@@ -0,0 +1,194 @@
+import functools
+import heapq
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from app.models import engine
+
+# Per-stage instrumentation of the pipeline.
+#
+# While enabled, cursor events on the shared engine are attributed to every stage active in
+# the current thread (stages nest, and an outer stage includes its inner ones). For each stage
+# name the report holds the number of calls, wall time, SQL round trips, rows fetched by
+# SELECTs, rows affected by DML, and the slowest statements. When disabled no engine listener
+# is installed and an instrumented function only pays for one attribute check.
+#
+#     instrumentation.enable()
+#     populate_nv_tables()
+#     print(instrumentation.format_report())
+
+SLOWEST_STATEMENTS = 5  # Slowest statements kept per stage
+STATEMENT_PREVIEW = 200  # Characters of SQL kept for each slow statement
+
+
+class _StageFrame:
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.seconds = 0.0
+        self.statements = 0
+        self.rows_fetched = 0
+        self.rows_affected = 0
+        self.slowest = []  # min-heap of (seconds, sql)
+
+    def record(self, seconds, statement, rowcount, is_select):
+        self.statements += 1
+        if rowcount > 0:
+            if is_select:
+                self.rows_fetched += rowcount
+            else:
+                self.rows_affected += rowcount
+        if len(self.slowest) < SLOWEST_STATEMENTS:
+            heapq.heappush(self.slowest, (seconds, statement))
+        elif seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (seconds, statement))
+
+    def as_dict(self):
+        return {
+            "stage": self.name,
+            "seconds": self.seconds,
+            "statements": self.statements,
+            "rows_fetched": self.rows_fetched,
+            "rows_affected": self.rows_affected,
+            "slowest": [{"seconds": seconds, "sql": sql[:STATEMENT_PREVIEW]}
+                        for seconds, sql in sorted(self.slowest, reverse=True)],
+        }
+
+
+class Instrumentation:
+    def __init__(self, bind):
+        self.bind = bind
+        self.enabled = False
+        self.hooks = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._totals = {}
+
+    # ---- switching on and off
+
+    def enable(self):
+        if not self.enabled:
+            event.listen(self.bind, "before_cursor_execute", self._before_cursor_execute)
+            event.listen(self.bind, "after_cursor_execute", self._after_cursor_execute)
+            event.listen(self.bind, "handle_error", self._handle_error)
+            self.enabled = True
+
+    def disable(self):
+        if self.enabled:
+            event.remove(self.bind, "before_cursor_execute", self._before_cursor_execute)
+            event.remove(self.bind, "after_cursor_execute", self._after_cursor_execute)
+            event.remove(self.bind, "handle_error", self._handle_error)
+            self.enabled = False
+
+    def add_hook(self, hook):
+        # hook(record) is called with the dict of every finished stage call (see _StageFrame.as_dict)
+        self.hooks.append(hook)
+
+    def reset(self):
+        with self._lock:
+            self._totals = {}
+
+    # ---- stages
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        frame = _StageFrame(name)
+        stack = self._stack()
+        stack.append(frame)
+        try:
+            yield
+        finally:
+            stack.pop()
+            frame.seconds = time.perf_counter() - frame.start
+            self._merge(frame)
+            record = frame.as_dict()
+            for hook in self.hooks:
+                hook(record)
+
+    def _merge(self, frame):
+        with self._lock:
+            total = self._totals.get(frame.name)
+            if total is None:
+                total = self._totals[frame.name] = {"calls": 0, "frame": _StageFrame(frame.name)}
+            total["calls"] += 1
+            merged = total["frame"]
+            merged.seconds += frame.seconds
+            merged.statements += frame.statements
+            merged.rows_fetched += frame.rows_fetched
+            merged.rows_affected += frame.rows_affected
+            merged.slowest = heapq.nlargest(SLOWEST_STATEMENTS, merged.slowest + frame.slowest)
+            heapq.heapify(merged.slowest)
+
+    # ---- engine events
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("instrumentation_start", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info["instrumentation_start"].pop()
+        stack = self._stack()
+        if not stack:
+            return
+        is_select = cursor.description is not None
+        for frame in stack:
+            frame.record(seconds, statement, cursor.rowcount, is_select)
+
+    def _handle_error(self, exception_context):
+        # A failed statement never reaches after_cursor_execute; drop its start time
+        connection = exception_context.connection
+        starts = connection.info.get("instrumentation_start") if connection is not None else None
+        if starts:
+            starts.pop()
+
+    # ---- reporting
+
+    def report(self):
+        # {stage: {"calls", "seconds", "statements", "rows_fetched", "rows_affected", "slowest"}}
+        with self._lock:
+            report = {}
+            for name, total in self._totals.items():
+                record = total["frame"].as_dict()
+                del record["stage"]
+                report[name] = {"calls": total["calls"], **record}
+            return report
+
+    def format_report(self):
+        lines = [f"{'stage':<28} {'calls':>6} {'seconds':>10} {'statements':>11} {'fetched':>9} {'affected':>9}"]
+        for name, record in sorted(self.report().items(), key=lambda item: -item[1]["seconds"]):
+            lines.append(f"{name:<28} {record['calls']:>6} {record['seconds']:>10.3f} {record['statements']:>11} "
+                         f"{record['rows_fetched']:>9} {record['rows_affected']:>9}")
+            for slow in record["slowest"][:1]:
+                lines.append(f"{'':<28} slowest {slow['seconds']:.3f}s: {' '.join(slow['sql'].split())[:80]}")
+        return "\n".join(lines)
+
+
+# Instrumentation of the shared engine from models.py
+instrumentation = Instrumentation(engine)
+
+
+def instrumented(function=None, name=None):
+    # Decorator recording every call of the function as a stage (named after the function)
+    def decorate(function):
+        stage_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not instrumentation.enabled:
+                return function(*args, **kwargs)
+            with instrumentation.stage(stage_name):
+                return function(*args, **kwargs)
+        return wrapper
+
+    return decorate(function) if function is not None else decorate
@@ -0,0 +1,346 @@
+import math
+from collections import Counter
+from itertools import combinations
+
+from sqlalchemy import text
+
+from app.models import session_scope
+from app.instrumentation import instrumented
+from app.predicates import Predicate
+from app.views import MARKOVIEWS, NV_SOURCES, PROBABILISTIC_TABLES, _log_aggregates_sql, _complement_from_log
+from app.dialects import unnest_sql, bind_arrays
+
+# Exact P(Q) over the INDB through lineage.
+#
+# A query is a condition on the MarkoView keys, e.g. eq("aid1", 1) & eq("aid2", 2): it holds in
+# a world if some MarkoView tuple satisfying it holds there. Its lineage is a DNF over the
+# probabilistic base tuples given by the atoms of the MarkoView declarations: a V1(a1, a2)
+# tuple holds iff advisorp(a1, a2) and studentp(a2) do, a V2(a1, a2, a3) tuple iff
+# advisorp(a1, a2) and advisorp(a1, a3) do, and V3 only joins deterministic tables, so its
+# tuples always hold. The MarkoViews add the constraint lineage
+#
+#     W = OR over NV tuples t of  NV(t) AND body(t)
+#
+# where NV(t) is independent with probability 1 - weight(t) (w_0 = (1 - weight) / weight is
+# its odds; a weight-0 constraint tuple gets probability 1, a weight above 1 a negative one),
+# and P(Q) = (P0(Q or W) - P0(W)) / (1 - P0(W)).
+#
+# Clauses of W that share no variable with Q, directly or through other clauses, cancel out
+# of that formula, so only the connected component of W around Q is fetched (breadth first,
+# a few keyed SQL lookups per step). Both sides are computed as complements,
+# P(Q) = 1 - P0(not Q and not W) / P0(not W), which stays accurate when the constraints make
+# P0(W) round to 1. The component is evaluated exactly:
+#   - when Q only matches V1 tuples and no V2 tuple shares their advisorp tuples, Q and the
+#     component form the hierarchical query "exists y: studentp(y) and exists x:
+#     advisorp(x, y) and NV(x, y)", which is evaluated extensionally in SQL with an
+#     independent project over the advisors of each student, an independent join with
+#     studentp and an independent project over the students;
+#   - otherwise the lineage is compiled: independent sub-formulas are split apart, variables
+#     common to every clause are factored out, and Shannon expansion on the most frequent
+#     variable handles the rest, with memoization of repeated sub-formulas.
+#
+# The functions that build and evaluate lineage are public: app.components builds its
+# component index from the same clauses and evaluates it with the same compiler.
+
+MAX_LINEAGE_CLAUSES = 50000  # Larger components raise LineageTooLarge
+SUBSET_LOOKUP_SIZE = 4  # Clauses up to this size are absorbed by looking up their subsets
+
+
+class LineageTooLarge(RuntimeError):
+    pass
+
+
+class Lineage:
+    def __init__(self):
+        self.query = set()       # clauses of Q, frozensets of variables
+        self.constraint = set()  # clauses of the component of W around Q
+        self.probabilities = {}  # variable -> probability
+
+    def variables(self):
+        return set().union(*self.query, *self.constraint)
+
+
+# A variable is (table, *key): ("advisorp", aid1, aid2), ("studentp", aid), ("nv1", aid1, aid2), ...
+def nv_body(nv_table, key):
+    view = MARKOVIEWS[NV_SOURCES[nv_table][0]]
+    values = dict(zip(view.key_columns, key))
+    return {(table,) + tuple(values[column] for column in columns) for table, columns in view.atoms}
+
+
+def tuples_sql(session, table, columns):
+    # Condition: (columns) is one of the base tuples of table bound as :<table>0, :<table>1, ...
+    names = [f"{table}{i}" for i in range(len(columns))]
+    keys_sql = unnest_sql(session, names, PROBABILISTIC_TABLES[table], ["BIGINT"] * len(columns))
+    return f"({', '.join(columns)}) IN ({keys_sql})"
+
+
+def tuple_params(base_tuples):
+    # {table: [key, ...]} -> one list parameter per table and key column
+    return {f"{table}{i}": [key[i] for key in keys]
+            for table, keys in base_tuples.items() for i in range(len(PROBABILISTIC_TABLES[table]))}
+
+
+def query_condition(query):
+    if isinstance(query, Predicate):
+        return query.compile()
+    return query, {}
+
+
+def add_query_clauses(session, lineage, query, nv_tables):
+    where, params = query_condition(query)
+    for nv_table in nv_tables:
+        keys = ", ".join(NV_SOURCES[nv_table][1])
+        for row in session.execute(text(f"SELECT {keys} FROM {nv_table} WHERE {where}"), params):
+            lineage.query.add(frozenset(nv_body(nv_table, tuple(row))))
+
+
+def touching_nv_rows(session, base_tuples):
+    # NV tuples whose body contains one of the given base tuples ({table: [key, ...]})
+    params = bind_arrays(session, tuple_params(base_tuples))
+    for view in MARKOVIEWS.values():
+        conditions = [tuples_sql(session, table, columns)
+                      for table, columns in view.atoms if base_tuples.get(table)]
+        if not conditions:
+            continue
+        keys = view.key_columns
+        rows = session.execute(text(f"""
+            SELECT {", ".join(keys)}, weight FROM {view.nv_table}
+            WHERE {" OR ".join(conditions)}
+        """), params)
+        for row in rows:
+            yield view.nv_table, tuple(row[:len(keys)]), row.weight
+
+
+def group_by_table(variables):
+    base_tuples = {}
+    for variable in variables:
+        if variable[0] in PROBABILISTIC_TABLES:
+            base_tuples.setdefault(variable[0], []).append(variable[1:])
+    return base_tuples
+
+
+def _expand_component(session, lineage, max_clauses):
+    # Breadth-first closure of the W clauses sharing base tuples with Q
+    seen = set()
+    frontier = set().union(*lineage.query)
+    while frontier:
+        seen |= frontier
+        base_tuples = group_by_table(frontier)
+        frontier = set()
+        for nv_table, key, weight in touching_nv_rows(session, base_tuples):
+            nv_variable = (nv_table,) + key
+            if nv_variable in lineage.probabilities:
+                continue
+            lineage.probabilities[nv_variable] = 1 - weight
+            body = nv_body(nv_table, key)
+            lineage.constraint.add(frozenset(body | {nv_variable}))
+            frontier |= body - seen
+        if len(lineage.constraint) > max_clauses:
+            raise LineageTooLarge(f"The lineage component exceeds {max_clauses} clauses")
+
+
+def fetch_base_probabilities(session, lineage):
+    # Base tuples missing from their tables (stale NV tables) get probability 0
+    variables = [variable for variable in lineage.variables() if variable not in lineage.probabilities]
+    for variable in variables:
+        lineage.probabilities[variable] = 0.0
+    base_tuples = group_by_table(variables)
+    params = bind_arrays(session, tuple_params(base_tuples))
+    for table, keys in base_tuples.items():
+        columns = PROBABILISTIC_TABLES[table]
+        result = session.execute(text(f"""
+            SELECT {", ".join(columns)}, probability FROM {table}
+            WHERE {tuples_sql(session, table, columns)}
+        """), params)
+        for row in result:
+            lineage.probabilities[(table,) + tuple(row[:len(columns)])] = row.probability
+
+
+def query_nv_tables(query, views):
+    # NV tables the query ranges over: those of views (default: all) whose keys cover the
+    # predicate columns
+    return [nv_table for nv_table, (view, keys) in NV_SOURCES.items()
+            if (views is None or view in views)
+            and (not isinstance(query, Predicate) or query.applies_to(keys))]
+
+
+def build_lineage(session, query, views=None, max_clauses=MAX_LINEAGE_CLAUSES):
+    # Lineage of the query and of the component of W around it. views restricts the
+    # MarkoViews the query ranges over
+    lineage = Lineage()
+    add_query_clauses(session, lineage, query, query_nv_tables(query, views))
+    _expand_component(session, lineage, max_clauses)
+    fetch_base_probabilities(session, lineage)
+    return lineage
+
+
+# ---------------- Compiled evaluation -------------------
+
+def absorb(clauses):
+    # Drop clauses implied by a smaller one (a OR (a AND b) = a). Short clauses look up their
+    # proper subsets instead of comparing against every kept clause
+    kept = set()
+    for clause in sorted(clauses, key=len):
+        if clause in kept:
+            continue
+        if len(clause) <= SUBSET_LOOKUP_SIZE:
+            subsumed = any(frozenset(subset) in kept
+                           for size in range(len(clause)) for subset in combinations(clause, size))
+        else:
+            subsumed = any(smaller <= clause for smaller in kept)
+        if not subsumed:
+            kept.add(clause)
+    return frozenset(kept)
+
+
+def condition_certain(clauses, probabilities):
+    # Substitute the variables with probability 1 (e.g. NV tuples of weight-0 constraints) or 0
+    simplified = []
+    for clause in clauses:
+        if any(probabilities[variable] == 0 for variable in clause):
+            continue
+        simplified.append(frozenset(variable for variable in clause if probabilities[variable] != 1))
+    return absorb(simplified)
+
+
+def independent_parts(clauses):
+    # Split the clauses into groups that share no variable (union-find over the variables)
+    parent = {}
+
+    def find(variable):
+        while parent.setdefault(variable, variable) != variable:
+            parent[variable] = parent[parent[variable]]
+            variable = parent[variable]
+        return variable
+
+    for clause in clauses:
+        first, *rest = clause
+        for variable in rest:
+            parent[find(variable)] = find(first)
+    parts = {}
+    for clause in clauses:
+        parts.setdefault(find(next(iter(clause))), []).append(clause)
+    return [frozenset(part) for part in parts.values()]
+
+
+def none_probability(clauses, probabilities, memo):
+    # P(not F) for the DNF F. Working with the complement keeps products of independent parts
+    # exact: P(F) itself is often 1 up to rounding once W holds many clauses
+    if not clauses:
+        return 1.0
+    if frozenset() in clauses:
+        return 0.0
+    cached = memo.get(clauses)
+    if cached is not None:
+        return cached
+
+    parts = independent_parts(clauses)
+    if len(parts) > 1:
+        result = math.prod(none_probability(part, probabilities, memo) for part in parts)
+    elif len(clauses) == 1:
+        result = 1 - math.prod(probabilities[variable] for variable in next(iter(clauses)))
+    else:
+        common = frozenset.intersection(*clauses)
+        if common:
+            # F = common AND F'
+            p = math.prod(probabilities[variable] for variable in common)
+            rest = absorb(clause - common for clause in clauses)
+            result = 1 - p + p * none_probability(rest, probabilities, memo)
+        else:
+            # Shannon expansion on the variable occurring in most clauses
+            variable = Counter(v for clause in clauses for v in clause).most_common(1)[0][0]
+            if_true = absorb(clause - {variable} for clause in clauses)
+            if_false = frozenset(clause for clause in clauses if variable not in clause)
+            p = probabilities[variable]
+            result = p * none_probability(if_true, probabilities, memo) + \
+                (1 - p) * none_probability(if_false, probabilities, memo)
+    memo[clauses] = result
+    return result
+
+
+def lineage_probability(clauses, probabilities):
+    # Exact probability of a monotone DNF (iterable of variable sets) with independent variables
+    return 1 - none_probability(condition_certain(map(frozenset, clauses), probabilities), probabilities, {})
+
+
+def reduce_lineage(lineage):
+    # (query, constraint) clauses after substituting the certain variables, with the parts of
+    # W that then share nothing with Q dropped, since they cancel out of P(Q | not W)
+    probabilities = lineage.probabilities
+    query = condition_certain(lineage.query, probabilities)
+    constraint = condition_certain(lineage.constraint, probabilities)
+    if frozenset() in constraint:
+        raise ValueError("The MarkoView constraints hold in every world; P(Q) is undefined")
+    query_variables = set().union(*query)
+    constraint = frozenset().union(*(part for part in independent_parts(constraint)
+                                     if query_variables & set().union(*part)))
+    return query, constraint
+
+
+def conditional_probability(lineage):
+    # P(Q | not W) = 1 - P0(not Q and not W) / P0(not W)
+    probabilities = lineage.probabilities
+    query, constraint = reduce_lineage(lineage)
+    memo = {}
+    none_w = none_probability(constraint, probabilities, memo)
+    none_q_or_w = none_probability(absorb(query | constraint), probabilities, memo)
+    return 1 - none_q_or_w / none_w
+
+
+# ---------------- Extensional evaluation of the safe case -------------------
+
+def is_hierarchical(lineage):
+    # Q only matches V1 tuples (advisorp AND studentp) and no clause of another view shares
+    # their tuples
+    return bool(lineage.query) and all(len(clause) == 2 and any(v[0] == "studentp" for v in clause)
+                                 for clause in lineage.query) \
+        and all(variable[0] in PROBABILISTIC_TABLES or variable[0] == "nv1"
+                for clause in lineage.constraint for variable in clause)
+
+
+def safe_plan(session, query):
+    # P(Q | not W1) for W1 the V1 clauses of the students of Q's V1 tuples. Per student y, the
+    # advisors are an independent project inside SQL:
+    #   W1:      1 - prod_x (1 - advisorp(x, y) * NV(x, y))
+    #   Q or W1: same, with NV(x, y) replaced by 1 for the tuples matched by Q
+    # and the independent join with studentp(y) and the project over y follow in Python
+    where, params = query_condition(query)
+    with_q_sql, with_q_params = _log_aggregates_sql(w_0="a.probability * CASE WHEN q.aid1 IS NULL "
+                                                         "THEN 1 - nv1.weight ELSE 1 END")
+    w_sql, _ = _log_aggregates_sql(w_0="a.probability * (1 - nv1.weight)", prefix="w_")
+    params.update(with_q_params)
+    rows = session.execute(text(f"""
+        WITH q AS (
+            SELECT aid1, aid2 FROM nv1 WHERE {where}
+        )
+        SELECT nv1.aid2, s.probability AS student, {with_q_sql}, {w_sql}
+        FROM nv1
+        JOIN advisorp a ON a.aid1 = nv1.aid1 AND a.aid2 = nv1.aid2
+        JOIN studentp s ON s.aid = nv1.aid2
+        LEFT JOIN q ON q.aid1 = nv1.aid1 AND q.aid2 = nv1.aid2
+        WHERE nv1.aid2 IN (SELECT aid2 FROM q)
+        GROUP BY nv1.aid2, s.probability
+    """), params)
+    none_q_or_w, none_w = 1.0, 1.0
+    for row in rows:
+        none_q_or_w *= 1 - row.student * _complement_from_log(row.log_abs, row.n_negative, row.n_zero)
+        none_w *= 1 - row.student * _complement_from_log(row.w_log_abs, row.w_n_negative, row.w_n_zero)
+    if none_w == 0:
+        raise ValueError("The MarkoView constraints hold in every world; P(Q) is undefined")
+    return 1 - none_q_or_w / none_w
+
+
+@instrumented
+def exact_compute_PQ(session, query, views=None, max_clauses=MAX_LINEAGE_CLAUSES):
+    # Exact P(Q) under the MarkoView semantics (see the top of this module); query is a
+    # Predicate or a raw SQL condition on the view keys
+    with session_scope(session) as session:
+        lineage = build_lineage(session, query, views, max_clauses)
+        if not lineage.query:
+            return 0.0
+        if not lineage.constraint:
+            # Q shares no base tuple with W, so P(Q) = P0(Q)
+            return lineage_probability(lineage.query, lineage.probabilities)
+        if is_hierarchical(lineage):
+            return safe_plan(session, query)
+    return conditional_probability(lineage)
@@ -1,17 +1,23 @@
 
 
 from sqlalchemy import text, Table, Column, Integer, Float, MetaData
-from app.models import create_tables, session, Author, Wrote, Studentp, Advisorp, Affiliation, Pub
+from app.models import create_tables, Session, Author, Wrote, Studentp, Advisorp, Affiliation, Pub
 from app.views import create_view_v1, create_view_v2, enforce_constraint_v2, show_view_v1, show_view_v3, \
     transform_mvdb_to_indb, create_nv_tables, populate_nv_tables, compute_PQ, m_compute_PQ, compute_P0_Q_or_W, \
     compute_P0_W, create_view_v3
+from app.predicates import eq
+from app.dblp import load_dblp
 
 import math
+import sys
 
 
 # Create all tables
 create_tables()
 
+# Session of this script; the pipeline functions below open their own pooled sessions
+session = Session()
+
 # Insert data
 def populate_data():
     # Clear existing data from the tables (order matters to avoid foreign key constraint violations)
@@ -76,7 +82,11 @@ def populate_data():
         session.rollback()
         print(f"An error occurred while adding sample data: {e}")
 
-populate_data()
+if len(sys.argv) > 1:
+    # Load the real DBLP dump instead of the toy data, e.g. python main.py /data/dblp.xml
+    load_dblp(sys.argv[1])
+else:
+    populate_data()
 # Run This to create NV tables and populate them
 
 #---------------
@@ -95,7 +105,7 @@ show_view_v3()
 # Transform the MVDB into the INDB
 transform_mvdb_to_indb()
 #Compute the arbitrary Query condition
-query_condition = "aid1 = 1 AND aid2 = 2"  # Example condition
+query_condition = eq("aid1", 1) & eq("aid2", 2)  # Example condition: aid1 = 1 AND aid2 = 2
 probability = compute_PQ(session, query_condition)
 probability_Q_OR_W = compute_P0_Q_or_W(session,query_condition)
 Probability_P0_W = compute_P0_W(session)
@@ -105,4 +115,6 @@ print(f"the Prob of P0_W is: {Probability_P0_W}")
 
 
 probability2 = m_compute_PQ(session, query_condition)
-print(f"The probability of the query for m_PQ is: {probability2}")
\ No newline at end of file
+print(f"The probability of the query for m_PQ is: {probability2}")
+
+session.close()
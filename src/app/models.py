@@ -1,15 +1,89 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, Table, MetaData
+from sqlalchemy import create_engine, event, Column, Integer, BigInteger, String, Float, Table, MetaData, Index, inspect
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from config import DATABASE_URL  # Import the DB config
-from lxml import etree
-import os
-import re
-
-# Initialize the engine and session
-engine = create_engine(DATABASE_URL)
+from sqlalchemy.pool import StaticPool
+from config import DATABASE_URL, POOL_SIZE, MAX_OVERFLOW, POOL_TIMEOUT, POOL_RECYCLE, STATEMENT_TIMEOUT
+from contextlib import contextmanager, closing
+import csv
+import io
+import math
+
+
+def _strict(function):
+    # NULL in, NULL out, like the PostgreSQL built-ins
+    return lambda value: None if value is None else function(value)
+
+
+def _least(*values):
+    values = [value for value in values if value is not None]
+    return min(values) if values else None
+
+
+def _greatest(*values):
+    values = [value for value in values if value is not None]
+    return max(values) if values else None
+
+
+# PostgreSQL functions used by the pipeline SQL that SQLite does not provide
+SQLITE_FUNCTIONS = {
+    "LN": (1, _strict(math.log)),
+    "EXP": (1, _strict(math.exp)),
+    "LEAST": (-1, _least),
+    "GREATEST": (-1, _greatest),
+}
+
+
+def make_engine(url=DATABASE_URL):
+    # Pooled PostgreSQL engine, or an SQLite engine (e.g. "sqlite:///markoviews.db", or
+    # "sqlite://" for an in-memory database private to the engine) with the functions above
+    # registered on every connection. All sessions of an in-memory engine share its one
+    # connection. STATEMENT_TIMEOUT and the pool settings only apply to PostgreSQL
+    url = make_url(url)
+    if url.get_backend_name() != "sqlite":
+        connect_args = {"options": f"-c statement_timeout={STATEMENT_TIMEOUT}"} if STATEMENT_TIMEOUT else {}
+        return create_engine(
+            url,
+            pool_size=POOL_SIZE,
+            max_overflow=MAX_OVERFLOW,
+            pool_timeout=POOL_TIMEOUT,
+            pool_recycle=POOL_RECYCLE,
+            pool_pre_ping=True,
+            connect_args=connect_args,
+        )
+
+    if url.database in (None, "", ":memory:"):
+        sqlite_engine = create_engine(url, poolclass=StaticPool, connect_args={"check_same_thread": False})
+    else:
+        sqlite_engine = create_engine(url)
+
+    @event.listens_for(sqlite_engine, "connect")
+    def register_functions(dbapi_connection, connection_record):
+        for name, (n_arguments, function) in SQLITE_FUNCTIONS.items():
+            dbapi_connection.create_function(name, n_arguments, function, deterministic=True)
+
+    return sqlite_engine
+
+
+# Initialize the engine and the session factory. There is no shared session: every unit of
+# work (a pipeline stage, a query evaluation) uses its own session and therefore its own
+# pooled connection, so independent units can run in parallel threads
+engine = make_engine()
 Session = sessionmaker(bind=engine)
-session = Session()
+
+
+@contextmanager
+def session_scope(session=None):
+    # Use the caller's session as it is, or open a new one and close it (returning its
+    # connection to the pool) when the block ends; uncommitted work is rolled back on close
+    if session is not None:
+        yield session
+        return
+    session = Session()
+    try:
+        yield session
+    finally:
+        session.close()
 
 Base = declarative_base()
 
@@ -17,39 +91,51 @@ Base = declarative_base()
 # Defining Author table
 class Author(Base):
     __tablename__ = 'author'
-    aid = Column(Integer, primary_key=True)
+    aid = Column(BigInteger, primary_key=True)
     name = Column(String)
 
 # Defining Wrote table (relation between author and paper)
 class Wrote(Base):
     __tablename__ = 'wrote'
-    aid = Column(Integer, primary_key=True)
-    pid = Column(Integer, primary_key=True)
+    __table_args__ = (
+        Index('ix_wrote_pid_aid', 'pid', 'aid'),  # pid-first lookups (co-author joins in V1/V3)
+    )
+    aid = Column(BigInteger, primary_key=True)
+    pid = Column(BigInteger, primary_key=True)
 
 # Defining probabilistic Studentp table
 class Studentp(Base):
     __tablename__ = 'studentp'
-    aid = Column(Integer, primary_key=True)
+    aid = Column(BigInteger, primary_key=True)
     year = Column(Integer)
     probability = Column(Float)
 
 # Defining probabilistic Advisorp table
 class Advisorp(Base):
     __tablename__ = 'advisorp'
-    aid1 = Column(Integer, primary_key=True)
-    aid2 = Column(Integer, primary_key=True)
+    __table_args__ = (
+        Index('ix_advisorp_aid2_aid1', 'aid2', 'aid1'),  # student-side lookups (V1 joins Studentp on aid2)
+    )
+    aid1 = Column(BigInteger, primary_key=True)
+    aid2 = Column(BigInteger, primary_key=True)
     probability = Column(Float)
 
 # Defining the Affiliationp table
 class Affiliation(Base):
     __tablename__ = 'affiliation'
-    aid = Column(Integer, primary_key=True)
+    __table_args__ = (
+        Index('ix_affiliation_inst_aid', 'inst', 'aid'),  # V3 self-join on inst
+    )
+    aid = Column(BigInteger, primary_key=True)
     inst = Column(String)
 
 # Defining the Pub table
 class Pub(Base):
     __tablename__ = 'pub'
-    pid = Column(Integer, primary_key=True)
+    __table_args__ = (
+        Index('ix_pub_year_pid', 'year', 'pid'),  # year filters in V1/V3
+    )
+    pid = Column(BigInteger, primary_key=True)
     year = Column(Integer)
 
 
@@ -59,8 +145,8 @@ def create_nv_table(table_name):
     metadata = MetaData()
     nv_table = Table(
         table_name, metadata,
-        Column('aid1', Integer, primary_key=True),
-        Column('aid2', Integer, primary_key=True),
+        Column('aid1', BigInteger, primary_key=True),
+        Column('aid2', BigInteger, primary_key=True),
         Column('weight', Float),  # Original probability (from views)
         Column('w_0', Float)      # Transformed weight (from MarkoViews)
     )
@@ -68,139 +154,44 @@ def create_nv_table(table_name):
     return nv_table
 
 #------------------------------------------------
-# Create all tables in the database
-def create_tables():
-    Base.metadata.create_all(engine)
+# Create all tables in the database (bind: another engine than the configured one)
+def create_tables(bind=None):
+    bind = bind or engine
+    Base.metadata.create_all(bind)
+    # create_all skips tables that already exist, so provision their secondary indexes explicitly
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind, checkfirst=True)
+
+
+# Report which of the required access paths (table, columns) no index can serve. An index
+# (or primary key) serves a path if the path's columns are its leading columns, in any order
+# (bind: another engine or connection than the configured one)
+def missing_indexes(required, bind=None):
+    inspector = inspect(bind or engine)
+    missing = []
+    for table, columns in required:
+        indexed = [inspector.get_pk_constraint(table)["constrained_columns"]]
+        indexed += [index["column_names"] for index in inspector.get_indexes(table)]
+        if not any(set(index_columns[:len(columns)]) == set(columns) for index_columns in indexed):
+            missing.append((table, tuple(columns)))
+    return missing
 
 # Utility function to drop all tables if needed
-def drop_tables():
-    Base.metadata.drop_all(engine)
-
-
-
- # adding the DBLP dataset (dataset used in the paper)
- # File paths
-# dblp_file_path = r'C:\dblp.xml'
-# modified_file_path = r'C:\dblp.xml'
-#
-#
-#
-# def parse_dblp_xml():
-#     try:
-#                 # Read the XML content as a string
-#         with open(dblp_file_path, 'r', encoding='utf-8') as file:
-#             xml_content = file.read()
-#
-#                 # Ensure the XML declaration is not altered
-#         if not xml_content.strip().startswith('<?xml'):
-#             xml_content = '<?xml version="1.0" encoding="UTF-8"?>\n' + xml_content
-#
-#         # Replace known problematic entities with the appropriate characters
-#         entities = {
-#             '&uuml;': 'ü',
-#             '&auml;': 'ä',
-#             '&ouml;': 'ö',
-#             '&uacute;': 'ú',
-#             '&oacute;': 'ó',
-#             '&egrave;': 'è',
-#             '&eacute;': 'é',
-#             '&euml;': 'ë',
-#             '&icirc;': 'î',
-#             '&iuml;': 'ï',
-#             '&aacute;': 'á',
-#             '&atilde;': 'ã',
-#             '&Aacute;': 'Á',
-#             '&Ccedil;': 'Ç',
-#             '&aelig;': 'æ',
-#             '&iacute;': 'í',
-#             '&reg;': '®',
-#             '&ccedil;': 'ç',
-#             '&amp;': '&',  # Replace ampersand entity
-#             '&lt;': '<',  # Replace less than
-#             '&gt;': '>',           # Add more replacements as needed
-#         }
-#
-#         for entity, char in entities.items():
-#             xml_content = xml_content.replace(entity, char)
-#
-#                 # Replace standalone '&' with '&amp;' to avoid XML parsing errors
-#         xml_content = re.sub(r'&(?!amp;|lt;|gt;|quot;|apos;)', '&amp;', xml_content)
-#
-#                 # Escape '<' and '>' inside text to avoid XML parsing errors (exclude XML declaration)
-#         xml_content = re.sub(r'(?<!<\?xml[^>]*)(<)', '&lt;', xml_content)
-#         xml_content = re.sub(r'(?<!<\?xml[^>]*)(>)', '&gt;', xml_content)
-#
-#                 # Parse the modified XML
-#         tree = etree.fromstring(xml_content.encode('utf-8'))
-#         root = tree
-#
-#                 # Process the XML data as needed
-#         authors_data = []
-#         for publication in root.findall('.//article') + root.findall('.//inproceedings'):
-#             for author in publication.findall('author'):
-#                 author_name = author.text
-#                 authors_data.append(author_name)
-#
-#         return authors_data
-#
-#     except Exception as e:
-#         print(f"An error occurred while parsing the XML: {e}")
-#         return []
-#
-#
-#         # Extract data
-# authors = parse_dblp_xml()
-# print(authors)
-#
-#
-# # Extract data
-# authors = parse_dblp_xml()
-# print(authors)
-# # dblp_file_path = r'C:\dblp.xml'  # Path to your modified DBLP file
-#
-#
-# def parse_dblp_xml():
-#     try:
-#         # Read the file content as bytes
-#         with open(dblp_file_path, 'rb') as file:
-#             xml_content = file.read()
-#
-#         # Parse the XML content from bytes
-#         tree = etree.fromstring(xml_content)
-#         root = tree
-#
-#         authors_data = []
-#         wrote_data = []
-#
-#         # Iterate over each article/inproceedings in the XML
-#         for publication in root.findall('.//article') + root.findall('.//inproceedings'):
-#             pid = publication.find('title').text  # Simplified; might need to generate a unique ID
-#             year = publication.find('year').text if publication.find('year') is not None else 'Unknown'
-#
-#             # Extract all authors for this publication
-#             for author in publication.findall('author'):
-#                 author_name = author.text
-#                 aid = hash(author_name)  # Simplified; generate a unique ID based on author name
-#
-#                 # Append author to the list (assuming unique aid)
-#                 authors_data.append({'aid': aid, 'name': author_name})
-#
-#                 # Append the publication relationship to 'wrote' data
-#                 wrote_data.append({'aid': aid, 'pid': pid})
-#
-#         return authors_data, wrote_data
-#
-#     except Exception as e:
-#         print(f"An error occurred while parsing the DBLP XML: {e}")
-#         return [], []
-#
-# # Extract data
-# authors, wrote_relations = parse_dblp_xml()
-
-
-
-
-
-
-
-
+def drop_tables(bind=None):
+    Base.metadata.drop_all(bind or engine)
+
+
+# Bulk-load rows into a table with COPY ... FROM STDIN, using a raw DBAPI (psycopg2) connection,
+# or with executemany on drivers without COPY (sqlite3). Rows are iterables of column values;
+# None is loaded as NULL
+def copy_rows(dbapi_connection, table, columns, rows):
+    with closing(dbapi_connection.cursor()) as cursor:
+        if not hasattr(cursor, "copy_expert"):
+            placeholders = ", ".join("?" for _ in columns)
+            cursor.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", rows)
+            return
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
@@ -0,0 +1,108 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import text
+
+from config import NV_BUILD_WORKERS
+from app.models import Session, engine
+from app.instrumentation import instrumented
+from app.views import NV_SOURCES, VIEW_SQL, _w0_sql, bump_nv_version, create_nv_tables
+from app.dialects import dialect_name
+
+# Parallel rebuild of the NV tables.
+#
+# The three MarkoViews are independent, and within a view every group belongs to one aid1, so
+# the work splits into (view, aid1 bucket) tasks, a bucket being the aid1 values with one
+# remainder modulo the number of buckets. Every aid1 falls in exactly one bucket, whether or
+# not it is a known author (advisorp has no foreign key to author), and the buckets stay even
+# for sequential ids, for the hashed DBLP ids and for skewed id distributions, where equal
+# width ranges would not. Each task evaluates its slice of the view body on its own pooled
+# connection into an UNLOGGED staging table nvN_build, with w_0 computed on the way. Once every
+# task succeeded, one transaction replaces the contents of nv1/nv2/nv3 with the staged rows and
+# bumps the NV version, so readers see either the old or the new NV tables and never a partial
+# build. If a task fails the NV tables are untouched.
+#
+# Only one build may run at a time, since the staging tables have fixed names. PostgreSQL only:
+# SQLite serializes writers, so populate_nv_tables() is the way to build there.
+
+
+def _staging_table(nv_table):
+    return f"{nv_table}_build"
+
+
+def _create_staging_tables():
+    with Session() as session:
+        for nv_table in NV_SOURCES:
+            staging = _staging_table(nv_table)
+            session.execute(text(f"DROP TABLE IF EXISTS {staging}"))
+            session.execute(text(f"CREATE UNLOGGED TABLE {staging} (LIKE {nv_table} INCLUDING DEFAULTS)"))
+        session.commit()
+
+
+def _drop_staging_tables():
+    with Session() as session:
+        for nv_table in NV_SOURCES:
+            session.execute(text(f"DROP TABLE IF EXISTS {_staging_table(nv_table)}"))
+        session.commit()
+
+
+def _build_slice(nv_table, bucket, buckets):
+    # Evaluate the groups whose aid1 is congruent to bucket modulo buckets (hashed DBLP ids
+    # may be negative, hence the double modulo)
+    view, keys = NV_SOURCES[nv_table]
+    columns = ", ".join(keys + ("weight",))
+    with Session() as session:
+        result = session.execute(text(f"""
+            INSERT INTO {_staging_table(nv_table)} ({columns}, w_0)
+            SELECT {columns}, {_w0_sql("CAST(weight AS FLOAT)")}
+            FROM ({VIEW_SQL[view]}) AS v
+            WHERE (aid1 % :buckets + :buckets) % :buckets = :bucket
+        """), {"bucket": bucket, "buckets": buckets})
+        session.commit()
+        return result.rowcount
+
+
+def _swap_in_staged_rows():
+    # Replace the NV contents in one transaction; duplicate keys are skipped as in
+    # populate_nv_tables
+    counts = {}
+    with Session() as session:
+        try:
+            session.execute(text(f"TRUNCATE {', '.join(NV_SOURCES)}"))
+            for nv_table, (_, keys) in NV_SOURCES.items():
+                columns = ", ".join(keys + ("weight", "w_0"))
+                result = session.execute(text(f"""
+                    INSERT INTO {nv_table} ({columns})
+                    SELECT {columns} FROM {_staging_table(nv_table)}
+                    ON CONFLICT DO NOTHING
+                """))
+                counts[nv_table] = result.rowcount
+            bump_nv_version(session)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+    return counts
+
+
+@instrumented
+def build_nv_tables_parallel(workers=NV_BUILD_WORKERS, buckets=None):
+    # Rebuild nv1/nv2/nv3 (weight and w_0) from the MarkoViews with `workers` concurrent
+    # connections, splitting each view into `buckets` aid1 buckets (default: workers).
+    # Replaces populate_nv_tables() + transform_mvdb_to_indb(); returns rows per NV table
+    if dialect_name(engine) != "postgresql":
+        raise RuntimeError("build_nv_tables_parallel requires PostgreSQL; use populate_nv_tables()")
+    buckets = buckets or workers
+    create_nv_tables()
+    _create_staging_tables()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_build_slice, nv_table, bucket, buckets)
+                       for nv_table in NV_SOURCES for bucket in range(buckets)]
+            staged = sum(future.result() for future in futures)
+        counts = _swap_in_staged_rows()
+    finally:
+        _drop_staging_tables()
+
+    print(f"NV tables rebuilt from {staged} staged tuples with {workers} workers "
+          f"and {buckets} buckets per view: {counts}")
+    return counts
@@ -0,0 +1,107 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import text
+
+from config import NV_BUILD_WORKERS
+from app.models import Session, engine
+from app.instrumentation import instrumented
+from app.views import NV_SOURCES, VIEW_SQL, NV_PARTITION_KEY, _w0_sql, bump_nv_version
+from app.dialects import dialect_name
+
+# Partition-wise maintenance of hash-partitioned NV tables (create_nv_tables(partitions=n),
+# PostgreSQL only).
+#
+# Every NV tuple lives in the partition of the hash of its aid1, and every group of a view
+# belongs to one aid1, so a partition can be rebuilt on its own: its slice of the view body
+# is selected with satisfies_hash_partition() on aid1, a condition PostgreSQL pushes below
+# the GROUP BY down to the base tables, and replaces the partition's rows in one
+# transaction. Rebuilds and VACUUM run over the partitions with NV_BUILD_WORKERS concurrent
+# connections. Readers see each partition either before or after its rebuild; the NV
+# version is bumped with every partition.
+#
+# Keyed queries need nothing special: a condition on aid1 lets PostgreSQL prune the other
+# partitions, including in the prepared plans used by compute_PQ.
+
+_BOUND = re.compile(r"modulus (\d+), remainder (\d+)")
+
+
+def nv_partitions(session, nv_tables=None):
+    # [(nv_table, partition, modulus, remainder)] of the partitioned NV tables
+    partitions = []
+    for nv_table in nv_tables or NV_SOURCES:
+        rows = session.execute(text("""
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) AS bound
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(:nv_table)
+            ORDER BY c.relname
+        """), {"nv_table": nv_table})
+        for row in rows:
+            modulus, remainder = map(int, _BOUND.search(row.bound).groups())
+            partitions.append((nv_table, row.relname, modulus, remainder))
+    return partitions
+
+
+def _require_postgres():
+    if dialect_name(engine) != "postgresql":
+        raise RuntimeError("NV table partitions require PostgreSQL")
+
+
+def _rebuild_partition(nv_table, partition, modulus, remainder):
+    view, keys = NV_SOURCES[nv_table]
+    columns = ", ".join(keys + ("weight",))
+    with Session() as session:
+        try:
+            session.execute(text(f"TRUNCATE {partition}"))
+            result = session.execute(text(f"""
+                INSERT INTO {partition} ({columns}, w_0)
+                SELECT {columns}, {_w0_sql("CAST(weight AS FLOAT)")}
+                FROM ({VIEW_SQL[view]}) AS v
+                WHERE satisfies_hash_partition(CAST(:nv_table AS regclass), :modulus, :remainder, {NV_PARTITION_KEY})
+                ON CONFLICT DO NOTHING
+            """), {"nv_table": nv_table, "modulus": modulus, "remainder": remainder})
+            bump_nv_version(session)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+    return result.rowcount
+
+
+@instrumented
+def rebuild_nv_partitions(nv_tables=None, workers=NV_BUILD_WORKERS):
+    # Recompute weight and w_0 of every partition of the given (default: all) NV tables from
+    # the MarkoViews, `workers` partitions at a time; returns rows per partition
+    _require_postgres()
+    with Session() as session:
+        partitions = nv_partitions(session, nv_tables)
+    if not partitions:
+        print("No partitioned NV tables to rebuild.")
+        return {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {partition: executor.submit(_rebuild_partition, nv_table, partition, modulus, remainder)
+                   for nv_table, partition, modulus, remainder in partitions}
+        counts = {partition: future.result() for partition, future in futures.items()}
+    print(f"Rebuilt {len(counts)} NV partitions with {workers} workers: {sum(counts.values())} tuples")
+    return counts
+
+
+def _vacuum_partition(partition, analyze):
+    # VACUUM cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text(f"VACUUM {'(ANALYZE) ' if analyze else ''}{partition}"))
+
+
+@instrumented
+def vacuum_nv_partitions(nv_tables=None, workers=NV_BUILD_WORKERS, analyze=True):
+    # VACUUM (and by default ANALYZE) the partitions of the given (default: all) NV tables,
+    # `workers` partitions at a time; returns the partitions processed
+    _require_postgres()
+    with Session() as session:
+        partitions = [partition for _, partition, _, _ in nv_partitions(session, nv_tables)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for future in [executor.submit(_vacuum_partition, partition, analyze) for partition in partitions]:
+            future.result()
+    print(f"Vacuumed {len(partitions)} NV partitions with {workers} workers.")
+    return partitions
@@ -0,0 +1,86 @@
+# Structured query conditions over the NV key columns.
+#
+# A Predicate is a conjunction of simple terms (equality or range on aid1/aid2/aid3/inst)
+# that compiles to SQL with bound parameters. The SQL text only depends on the shape of
+# the predicate, not on its values, so repeated queries reuse the same prepared plan:
+#
+#     query = eq("aid1", 1) & eq("aid2", 2)
+#     compute_PQ(session, query)
+
+PREDICATE_COLUMNS = ("aid1", "aid2", "aid3", "inst")
+OPERATORS = ("=", "<", "<=", ">", ">=", "BETWEEN")
+
+
+class Predicate:
+    def __init__(self, terms=()):
+        for column, op, values in terms:
+            if column not in PREDICATE_COLUMNS:
+                raise ValueError(f"Unsupported predicate column: {column!r}")
+            if op not in OPERATORS:
+                raise ValueError(f"Unsupported predicate operator: {op!r}")
+        # Terms are kept in a canonical order so equal conditions compile to equal SQL
+        self.terms = tuple(sorted(terms, key=lambda term: (term[0], term[1], repr(term[2]))))
+
+    def __and__(self, other):
+        return Predicate(self.terms + other.terms)
+
+    def __eq__(self, other):
+        return isinstance(other, Predicate) and self.terms == other.terms
+
+    def __hash__(self):
+        return hash(self.terms)
+
+    def __repr__(self):
+        return f"Predicate({self})"
+
+    def __str__(self):
+        return " AND ".join(
+            f"{column} BETWEEN {values[0]!r} AND {values[1]!r}" if op == "BETWEEN" else f"{column} {op} {values[0]!r}"
+            for column, op, values in self.terms
+        ) or "TRUE"
+
+    def columns(self):
+        return {column for column, _, _ in self.terms}
+
+    def applies_to(self, columns):
+        # A table lacking one of the predicate columns has no tuple that can satisfy it
+        return self.columns() <= set(columns)
+
+    def compile(self, prefix="p"):
+        # Returns (sql, params) with one :<prefix><n> placeholder per value
+        clauses, params = [], {}
+        for column, op, values in self.terms:
+            names = []
+            for value in values:
+                name = f"{prefix}{len(params)}"
+                params[name] = value
+                names.append(f":{name}")
+            if op == "BETWEEN":
+                clauses.append(f"{column} BETWEEN {names[0]} AND {names[1]}")
+            else:
+                clauses.append(f"{column} {op} {names[0]}")
+        return " AND ".join(clauses) or "TRUE", params
+
+
+def eq(column, value):
+    return Predicate([(column, "=", (value,))])
+
+
+def lt(column, value):
+    return Predicate([(column, "<", (value,))])
+
+
+def le(column, value):
+    return Predicate([(column, "<=", (value,))])
+
+
+def gt(column, value):
+    return Predicate([(column, ">", (value,))])
+
+
+def ge(column, value):
+    return Predicate([(column, ">=", (value,))])
+
+
+def between(column, low, high):
+    return Predicate([(column, "BETWEEN", (low, high))])
@@ -0,0 +1,165 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from config import RESULT_CACHE_BYTES, RESULT_CACHE_VERSION_TTL
+from app.predicates import Predicate
+from app.dialects import database_key
+
+# Result cache for compute_PQ / m_compute_PQ.
+#
+# Results are kept per database under (function, normalized query, NV version) in an LRU
+# bounded by RESULT_CACHE_BYTES of approximate memory. Predicates are normalized by their
+# canonical terms, raw SQL conditions by their whitespace. The NV version of a database is
+# read again after RESULT_CACHE_VERSION_TTL seconds: when it differs from the one the cached
+# entries belong to, the entries of that database are dropped, and within the TTL hits need
+# no round trip. Changes made by this process invalidate at once: bump_nv_version marks its
+# session, and the entries of that database are dropped when the session commits, so a
+# reader never caches the old version after the new one is visible. Changes made by other
+# processes are seen after at most the TTL (0 reads the version on every call).
+#
+#     compute_PQ(session, eq("aid1", 1) & eq("aid2", 2))  # miss: runs the scans
+#     compute_PQ(session, eq("aid2", 2) & eq("aid1", 1))  # hit
+#     RESULT_CACHE.stats()
+
+ENTRY_OVERHEAD = 120  # Approximate bytes of the LRU node and key tuple of an entry
+
+
+def normalize_query(query):
+    if isinstance(query, Predicate):
+        return query.terms
+    return " ".join(query.split())
+
+
+def _size(value):
+    if isinstance(value, tuple):
+        return sys.getsizeof(value) + sum(_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class ResultCache:
+    def __init__(self, max_bytes=RESULT_CACHE_BYTES, version_ttl=RESULT_CACHE_VERSION_TTL):
+        self.max_bytes = max_bytes  # 0 disables the cache
+        self.version_ttl = version_ttl
+        self._entries = OrderedDict()  # (database, function, query, version) -> (value, size)
+        self._versions = {}  # database -> (NV version, time it was read)
+        self._bytes = 0
+        self._generation = 0  # Bumped by every invalidation, so a version read before it is not kept
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def key(self, session, function, query, read_version):
+        # Cache key of a call, or None when the cache is disabled; read_version() returns
+        # the NV version of the session
+        if not self.max_bytes:
+            return None
+        database = database_key(session)
+        now = time.monotonic()
+        known = self._versions.get(database)
+        if known is not None and now - known[1] < self.version_ttl:
+            version = known[0]
+        else:
+            generation = self._generation
+            version = read_version()
+            with self._lock:
+                if known is not None and known[0] != version:
+                    self._drop(database)
+                if generation == self._generation:
+                    self._versions[database] = (version, now)
+        # The version stays in the key, so a result computed while the version changed is
+        # never served under the new one
+        return database, function, normalize_query(query), version
+
+    def get(self, key):
+        # Cached value or None
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        if key is None:
+            return
+        size = ENTRY_OVERHEAD + _size(key) + _size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self.evictions += 1
+
+    def _drop(self, database):
+        dropped = [key for key in self._entries if key[0] == database]
+        for key in dropped:
+            self._bytes -= self._entries.pop(key)[1]
+        if dropped:
+            self.invalidations += 1
+
+    def invalidate(self, session=None):
+        # Drop the entries and the known version of the session's database, or of every
+        # database when session is None
+        with self._lock:
+            self._generation += 1
+            if session is None:
+                if self._entries:
+                    self.invalidations += 1
+                self._entries.clear()
+                self._versions.clear()
+                self._bytes = 0
+            else:
+                database = database_key(session)
+                self._versions.pop(database, None)
+                self._drop(database)
+
+    def invalidate_on_commit(self, session):
+        # Invalidate the session's database once its transaction commits (see bump_nv_version)
+        session.info["result_cache_invalidate"] = True
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.evictions = self.invalidations = 0
+
+
+RESULT_CACHE = ResultCache()
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    if session.info.pop("result_cache_invalidate", False):
+        RESULT_CACHE.invalidate(session)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _forget_rolled_back_invalidation(session, transaction):
+    # A rolled back change leaves the cached versions valid
+    if transaction.parent is None:
+        session.info.pop("result_cache_invalidate", None)
@@ -0,0 +1,185 @@
+import math
+import time
+from statistics import NormalDist
+
+import numpy as np
+
+from app.models import session_scope
+from app.instrumentation import instrumented
+from app.lineage import MAX_LINEAGE_CLAUSES, build_lineage, reduce_lineage
+
+# Monte Carlo estimation of P(Q) for queries whose lineage is too large to compile.
+#
+# The lineage comes from app.lineage (the query and the component of the MarkoView constraints
+# W around it, with certain variables substituted). Possible worlds are drawn in NumPy
+# batches, as boolean matrices with one column per variable, and clauses are evaluated with
+# fancy indexing. Sampling stops as soon as the requested accuracy is reached or after
+# max_samples worlds.
+#
+#   - If Q shares no variable with W, P(Q) = P0(Q) and the Karp-Luby estimator is used: draw a
+#     clause proportionally to its probability, then a world in which it holds, and count the
+#     draws where it is the first satisfied clause. The Dagum-Karp-Luby-Ross stopping rule gives
+#     a relative error of at most epsilon with probability at least 1 - delta.
+#   - Otherwise P(Q) = P0(Q and not W) / P0(not W) is estimated as a ratio. NV tuples of weight
+#     above 1 have negative probabilities, which rules out Karp-Luby, so variables are drawn
+#     with probability |p| / (|p| + |1 - p|) and each world carries the sign of its true
+#     probability (the magnitude of the weights is the same for every world and cancels). The
+#     stopping rule uses the normal approximation of the ratio (delta method) and stops when
+#     the confidence interval at level 1 - delta is at most epsilon wide on either side. When
+#     the constraints are rarely satisfied (e.g. advisors with many students under the V2
+#     constraint) few worlds are accepted; exact_compute_PQ is usually faster on those.
+#
+# max_samples and time_limit bound the work; an estimate that ran out of either is returned
+# with converged=False and the interval reached so far.
+
+MAX_BATCH_CELLS = 2 ** 26  # Bound on samples x clauses x clause length evaluated at once
+MIN_ACCEPTED = 100  # Worlds satisfying not W needed before the ratio's interval is trusted
+
+
+class Estimate:
+    def __init__(self, estimate, low, high, samples, converged, method):
+        self.estimate = estimate
+        self.low = low
+        self.high = high
+        self.samples = samples
+        self.converged = converged  # False if max_samples ran out before the accuracy was reached
+        self.method = method
+
+    def __repr__(self):
+        status = "" if self.converged else ", not converged"
+        return (f"Estimate({self.estimate:.6g} in [{self.low:.6g}, {self.high:.6g}], "
+                f"{self.samples} samples, {self.method}{status})")
+
+
+class _Formula:
+    # A DNF as a padded index matrix: row c lists the variables of clause c, padded with the
+    # index of an always-true column
+    def __init__(self, clauses, index):
+        width = max((len(clause) for clause in clauses), default=1) or 1
+        self.padding = len(index)
+        self.matrix = np.full((len(clauses), width), self.padding, dtype=np.int64)
+        for row, clause in enumerate(clauses):
+            self.matrix[row, :len(clause)] = [index[variable] for variable in clause]
+
+    def cells(self):
+        return self.matrix.size
+
+    def satisfied(self, worlds):
+        # worlds: (samples, variables) bool -> (samples, clauses) bool
+        padded = np.concatenate([worlds, np.ones((len(worlds), 1), dtype=bool)], axis=1)
+        return padded[:, self.matrix].all(axis=2)
+
+
+def _batch_size(batch_size, *formulas):
+    cells = sum(formula.cells() for formula in formulas)
+    return max(1, min(batch_size, MAX_BATCH_CELLS // max(cells, 1)))
+
+
+def _karp_luby(clauses, probabilities, epsilon, delta, batch_size, max_samples, deadline, rng):
+    clauses = list(clauses)  # Fixed order: row c of the formula is clause c
+    variables = sorted(set().union(*clauses))
+    index = {variable: i for i, variable in enumerate(variables)}
+    formula = _Formula(clauses, index)
+    p = np.array([probabilities[variable] for variable in variables])
+    clause_probabilities = np.array([math.prod(probabilities[v] for v in clause) for clause in clauses])
+    total = clause_probabilities.sum()
+    if total == 0:
+        return Estimate(0.0, 0.0, 0.0, 0, True, "karp-luby")
+    choice = clause_probabilities / total
+
+    threshold = 1 + (1 + epsilon) * 4 * (math.e - 2) * math.log(2 / delta) / epsilon ** 2
+    batch = _batch_size(batch_size, formula)
+    hits, samples = 0, 0
+    while samples < max_samples and time.perf_counter() < deadline:
+        size = min(batch, max_samples - samples)
+        chosen = rng.choice(len(choice), size=size, p=choice)
+        worlds = rng.random((size, len(variables))) < p
+        rows = np.repeat(np.arange(size), formula.matrix.shape[1])
+        columns = formula.matrix[chosen].ravel()
+        keep = columns < formula.padding
+        worlds[rows[keep], columns[keep]] = True
+        # The draw counts if the chosen clause is the first one the world satisfies
+        first = formula.satisfied(worlds).argmax(axis=1)
+        successes = np.cumsum(first == chosen)
+        if hits + successes[-1] >= threshold:
+            stop = int(np.searchsorted(successes, threshold - hits)) + 1
+            samples += stop
+            estimate = total * threshold / samples
+            return Estimate(estimate, estimate / (1 + epsilon), min(estimate / (1 - epsilon), 1.0),
+                            samples, True, "karp-luby")
+        hits += int(successes[-1])
+        samples += size
+
+    # Out of samples or time: normal interval around the plain mean
+    if not samples:
+        return Estimate(math.nan, 0.0, 1.0, 0, False, "karp-luby")
+    mean = hits / samples
+    half_width = NormalDist().inv_cdf(1 - delta / 2) * math.sqrt(mean * (1 - mean) / samples)
+    return Estimate(total * mean, max(total * (mean - half_width), 0.0), min(total * (mean + half_width), 1.0),
+                    samples, False, "karp-luby")
+
+
+def _signed_ratio(query, constraint, probabilities, epsilon, delta, batch_size, max_samples, deadline, rng):
+    variables = sorted(set().union(*query, *constraint))
+    index = {variable: i for i, variable in enumerate(variables)}
+    query_formula, constraint_formula = _Formula(query, index), _Formula(constraint, index)
+    p = np.array([probabilities[variable] for variable in variables])
+    sampling = np.abs(p) / (np.abs(p) + np.abs(1 - p))
+    negative_if_true, negative_if_false = p < 0, (1 - p) < 0
+
+    z_quantile = NormalDist().inv_cdf(1 - delta / 2)
+    batch = _batch_size(batch_size, query_formula, constraint_formula)
+    # Running sums of the signed indicators y = sign * [Q and not W] and z = sign * [not W]
+    sum_y = sum_z = sum_accepted_q = accepted = samples = 0
+    ratio, half_width = math.nan, math.inf
+    while samples < max_samples and time.perf_counter() < deadline:
+        size = min(batch, max_samples - samples)
+        worlds = rng.random((size, len(variables))) < sampling
+        negatives = np.where(worlds, negative_if_true, negative_if_false).sum(axis=1)
+        sign = np.where(negatives % 2 == 1, -1, 1)
+        allowed = ~constraint_formula.satisfied(worlds).any(axis=1)
+        holds = query_formula.satisfied(worlds).any(axis=1) & allowed
+        sum_y += int(sign[holds].sum())
+        sum_z += int(sign[allowed].sum())
+        sum_accepted_q += int(holds.sum())
+        accepted += int(allowed.sum())
+        samples += size
+
+        if sum_z <= 0 or accepted < MIN_ACCEPTED:
+            continue
+        ratio = sum_y / sum_z
+        # Delta method: Var(R) ~ E[(y - R z)^2] / (n E[z]^2), with y^2 = [Q and not W], z^2 = [not W]
+        second_moment = (sum_accepted_q * (1 - 2 * ratio) + ratio ** 2 * accepted) / samples
+        mean_z = sum_z / samples
+        half_width = z_quantile * math.sqrt(max(second_moment, 0.0) / samples) / mean_z
+        if half_width <= epsilon:
+            return Estimate(ratio, max(ratio - half_width, 0.0), min(ratio + half_width, 1.0),
+                            samples, True, "signed-ratio")
+    if math.isnan(ratio):
+        return Estimate(ratio, 0.0, 1.0, samples, False, "signed-ratio")
+    return Estimate(ratio, max(ratio - half_width, 0.0), min(ratio + half_width, 1.0), samples, False, "signed-ratio")
+
+
+@instrumented
+def estimate_PQ(session, query, epsilon=0.01, delta=0.05, views=None, batch_size=100000,
+                max_samples=10000000, time_limit=None, seed=None, max_clauses=MAX_LINEAGE_CLAUSES):
+    # Estimate P(Q) (same semantics as app.lineage.exact_compute_PQ) to within epsilon with
+    # probability at least 1 - delta; returns an Estimate with the confidence interval
+    if not 0 < epsilon < 1 or not 0 < delta < 1:
+        raise ValueError("epsilon and delta must lie in (0, 1)")
+    rng = np.random.default_rng(seed)
+    deadline = time.perf_counter() + time_limit if time_limit is not None else math.inf
+    with session_scope(session) as session:
+        lineage = build_lineage(session, query, views, max_clauses)
+    query_clauses, constraint = reduce_lineage(lineage)
+    if not query_clauses:
+        return Estimate(0.0, 0.0, 0.0, 0, True, "exact")
+    if frozenset() in query_clauses:
+        return Estimate(1.0, 1.0, 1.0, 0, True, "exact")
+
+    probabilities = lineage.probabilities
+    in_unit_interval = all(0 <= probabilities[v] <= 1 for clause in query_clauses for v in clause)
+    if not constraint and in_unit_interval:
+        return _karp_luby(query_clauses, probabilities, epsilon, delta, batch_size, max_samples, deadline, rng)
+    return _signed_ratio(query_clauses, constraint, probabilities, epsilon, delta, batch_size, max_samples,
+                         deadline, rng)
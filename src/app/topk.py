@@ -0,0 +1,136 @@
+import math
+
+from sqlalchemy import text
+
+from app.models import session_scope
+from app.instrumentation import instrumented
+from app.predicates import eq
+from app.lineage import query_condition, exact_compute_PQ
+from app.sampling import estimate_PQ
+
+# Top-k most probable V1 answers (advisor, student), e.g. the most likely advisors of author X:
+#
+#     top_k(session, 20, eq("aid2", X))
+#     top_k(session, 100)
+#
+# Every candidate V1(x, y) gets cheap bounds on its probability, then candidates are
+# evaluated (exact_compute_PQ, or estimate_PQ with method="sample") in order of decreasing
+# upper bound, until the k-th best probability found is at least the upper bound of every
+# candidate left. Only the candidates near the cut-off are evaluated.
+#
+# Bounds: in the MarkoView semantics the answer is the event A(x, y) and S(y) over the tuples
+# advisorp(x, y) and studentp(y). Its probability is a mixture, over the states of the
+# neighbouring advisorp tuples, of
+#
+#     P(answer | neighbours) = pa ps w u v / ((1 - pa)(1 - ps) + (1 - pa) ps u + pa (1 - ps) v + pa ps w u v)
+#
+# where w is the weight of V1(x, y), u the product of the weights of the V1(x', y) tuples of
+# the other advisors x' that hold, and v the product of the weights of the V2 tuples pairing
+# (x, y) with another student z of x whose advisorp(x, z) holds. This is increasing in u and
+# v, so evaluating it at the smallest and largest products the neighbours allow bounds the
+# probability for any weights, including the V1 weights above 1 that make NV probabilities
+# negative and rule out correlation inequalities.
+
+MAX_LOG_WEIGHT = 700.0  # Clamp for products of weights before exp()
+
+# Per candidate and kind of neighbour ('u': other advisors of the student, 'v': other students
+# of the advisor through V2), the smallest and largest factor each neighbour can contribute:
+# 1 if its advisorp tuple is impossible, its weight if certain, else between 1 and the weight
+_BOUNDS_SQL = """
+    WITH candidates AS (
+        SELECT nv1.aid1, nv1.aid2, nv1.weight, a.probability AS pa, s.probability AS ps
+        FROM (SELECT * FROM nv1 WHERE {where}) AS nv1
+        JOIN advisorp a ON a.aid1 = nv1.aid1 AND a.aid2 = nv1.aid2
+        JOIN studentp s ON s.aid = nv1.aid2
+    ), neighbours AS (
+        SELECT c.aid1, c.aid2, 'u' AS kind, o.weight, a.probability
+        FROM candidates c
+        JOIN nv1 o ON o.aid2 = c.aid2 AND o.aid1 <> c.aid1
+        JOIN advisorp a ON a.aid1 = o.aid1 AND a.aid2 = o.aid2
+        UNION ALL
+        SELECT c.aid1, c.aid2, 'v',
+               CASE WHEN MIN(n.weight) = 0 THEN 0 ELSE EXP(SUM(LN(NULLIF(n.weight, 0)))) END, MIN(a.probability)
+        FROM candidates c
+        JOIN nv2 n ON n.aid1 = c.aid1 AND (n.aid2 = c.aid2 OR n.aid3 = c.aid2)
+        JOIN advisorp a ON a.aid1 = n.aid1 AND a.aid2 = CASE WHEN n.aid2 = c.aid2 THEN n.aid3 ELSE n.aid2 END
+        GROUP BY c.aid1, c.aid2, a.aid2
+    ), factors AS (
+        SELECT aid1, aid2, kind,
+               CASE WHEN probability = 0 THEN 1 WHEN probability = 1 THEN weight ELSE LEAST(1, weight) END AS low,
+               CASE WHEN probability = 0 THEN 1 WHEN probability = 1 THEN weight ELSE GREATEST(1, weight) END AS high
+        FROM neighbours
+    ), products AS (
+        SELECT aid1, aid2, kind,
+               SUM(LN(NULLIF(low, 0))) AS low_log, COUNT(*) FILTER (WHERE low = 0) AS low_zero,
+               SUM(LN(NULLIF(high, 0))) AS high_log, COUNT(*) FILTER (WHERE high = 0) AS high_zero
+        FROM factors
+        GROUP BY aid1, aid2, kind
+    )
+    SELECT c.aid1, c.aid2, c.weight, c.pa, c.ps,
+           u.low_log AS u_low_log, u.low_zero AS u_low_zero, u.high_log AS u_high_log, u.high_zero AS u_high_zero,
+           v.low_log AS v_low_log, v.low_zero AS v_low_zero, v.high_log AS v_high_log, v.high_zero AS v_high_zero
+    FROM candidates c
+    LEFT JOIN products u ON u.aid1 = c.aid1 AND u.aid2 = c.aid2 AND u.kind = 'u'
+    LEFT JOIN products v ON v.aid1 = c.aid1 AND v.aid2 = c.aid2 AND v.kind = 'v'
+"""
+
+
+def _product(log, zeros):
+    if zeros:
+        return 0.0
+    return math.exp(min(log or 0.0, MAX_LOG_WEIGHT))
+
+
+def _answer_probability(pa, ps, w, u, v):
+    # P(answer | neighbours) from the module comment; None if no state is possible
+    numerator = pa * ps * w * u * v
+    denominator = (1 - pa) * (1 - ps) + (1 - pa) * ps * u + pa * (1 - ps) * v + numerator
+    return numerator / denominator if denominator > 0 else None
+
+
+def candidate_bounds(session, query=None):
+    # [(key, low, high)] for the V1 tuples satisfying the query (a Predicate, a raw SQL
+    # condition on aid1/aid2, or None for all)
+    where, params = query_condition(query if query is not None else "TRUE")
+    bounds = []
+    for row in session.execute(text(_BOUNDS_SQL.format(where=where)), params):
+        low = _answer_probability(row.pa, row.ps, row.weight,
+                                  _product(row.u_low_log, row.u_low_zero), _product(row.v_low_log, row.v_low_zero))
+        high = _answer_probability(row.pa, row.ps, row.weight,
+                                   _product(row.u_high_log, row.u_high_zero), _product(row.v_high_log, row.v_high_zero))
+        bounds.append(((row.aid1, row.aid2), 0.0 if low is None else low, 1.0 if high is None else high))
+    return bounds
+
+
+@instrumented
+def top_k(session, k, query=None, method="exact", **estimate_options):
+    # The k most probable V1 answers as [(key, probability)] (method="exact") or
+    # [(key, Estimate)] (method="sample", ranked by the estimate; estimate_options are passed
+    # to estimate_PQ), in decreasing order
+    if method not in ("exact", "sample"):
+        raise ValueError(f"Unknown top-k method: {method!r}")
+    if k < 1:
+        raise ValueError(f"k must be at least 1, got {k}")
+    with session_scope(session) as session:
+        candidates = sorted(candidate_bounds(session, query), key=lambda candidate: -candidate[2])
+        # Nothing ranked below the k-th largest lower bound can make it into the answer
+        lows = sorted((low for _, low, _ in candidates), reverse=True)
+        floor = lows[k - 1] if len(lows) >= k else 0.0
+
+        results = []
+        for key, low, high in candidates:
+            if high < floor:
+                break
+            if len(results) >= k and high <= results[k - 1][2]:
+                break
+            condition = eq("aid1", key[0]) & eq("aid2", key[1])
+            if method == "exact":
+                value = exact_compute_PQ(session, condition, views=("V1",))
+                results.append((key, value, value))
+            else:
+                estimate = estimate_PQ(session, condition, views=("V1",), **estimate_options)
+                results.append((key, estimate, estimate.estimate))
+            results.sort(key=lambda result: -result[2])
+
+    print(f"Top-{k}: evaluated {len(results)} of {len(candidates)} candidates")
+    return [(key, value) for key, value, _ in results[:k]]
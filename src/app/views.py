@@ -1,14 +1,100 @@
-from sqlalchemy import text, Table, Column, Integer, Float, MetaData, engine, String
-from app.models import session, engine
+import hashlib
+import logging
+import math
+import re
+
+from config import NV_PARTITIONS
+from sqlalchemy import text, Table, Column, Index, Integer, BigInteger, Float, MetaData, String
+from app.models import session_scope, missing_indexes
+from app.instrumentation import instrumented
+from app.predicates import Predicate
+from app.dialects import is_sqlite, unnest_sql, bind_arrays, database_key, distinct_sql
+from app.result_cache import RESULT_CACHE
+
+logger = logging.getLogger(__name__)
+
+# ---------------- MarkoView registry -------------------
+#
+# A MarkoView is declared once, with the NV table it feeds, its key columns (column -> SQL
+# expression over the body), its weight expression and the FROM ... part of its query. The
+# view, the NV table and its indexes, the set-based population, the w_0 transform and the
+# probability aggregates are all generated from the registry, so a new view only needs a
+# register_markoview() call. atoms lists the probabilistic base tuples a view tuple depends
+# on, as (table, key columns of the view), for the lineage in app.lineage; a view without
+# atoms only joins deterministic tables. indexes are the secondary indexes of the NV table and
+# of the materialized view, access_paths the base table columns its joins and filters look
+# up, checked by check_view_indexes().
+
+# Probabilistic base tables -> key columns
+PROBABILISTIC_TABLES = {"advisorp": ("aid1", "aid2"), "studentp": ("aid",)}
+
+# Column types of the NV key columns (SQL type names through nv_key_sql_type)
+NV_KEY_COLUMN_TYPES = {"aid1": BigInteger, "aid2": BigInteger, "aid3": BigInteger, "inst": String}
+
+# Hash-partitioned NV tables (PostgreSQL) are partitioned on this key column
+NV_PARTITION_KEY = "aid1"
+
+
+def nv_key_sql_type(column):
+    return NV_KEY_COLUMN_TYPES[column]().compile()
+
+
+class MarkoView:
+    def __init__(self, name, nv_table, keys, weight, body, atoms=(), indexes=(), access_paths=()):
+        self.name = name
+        self.nv_table = nv_table
+        self.keys = dict(keys)
+        self.weight = weight
+        self.body = body
+        self.atoms = tuple(atoms)
+        self.indexes = tuple(indexes)  # Secondary indexes, as column tuples
+        self.access_paths = tuple(access_paths)  # [(base table, columns)]
+
+    @property
+    def key_columns(self):
+        return tuple(self.keys)
+
+    def sql(self):
+        columns = ",\n            ".join(f"{expression} AS {column}" for column, expression in self.keys.items())
+        return f"""
+        SELECT
+            {columns},
+            {self.weight} AS weight{self.body}"""
+
+    def nv_table_definition(self, metadata, partitioned=False):
+        columns = [Column(column, NV_KEY_COLUMN_TYPES[column], primary_key=True) for column in self.keys]
+        options = {"postgresql_partition_by": f"HASH ({NV_PARTITION_KEY})"} if partitioned else {}
+        table = Table(self.nv_table, metadata, *columns, Column("weight", Float), Column("w_0", Float), **options)
+        for index_columns in self.indexes:
+            Index(f"ix_{self.nv_table}_{'_'.join(index_columns)}", *(table.c[column] for column in index_columns))
+        return table
+
+
+# Registered MarkoViews by name, in declaration order, and the lookups derived from them
+MARKOVIEWS = {}
+# MarkoView name -> defining query, for callers that evaluate a view body directly
+VIEW_SQL = {}
+# NV table -> (source MarkoView, key columns)
+NV_SOURCES = {}
+# MarkoView name -> [(table, columns)] of the base table lookups its joins need indexed
+VIEW_ACCESS_PATHS = {}
+
+
+def register_markoview(view):
+    MARKOVIEWS[view.name] = view
+    VIEW_SQL[view.name] = view.sql()
+    NV_SOURCES[view.nv_table] = (view.name, view.key_columns)
+    VIEW_ACCESS_PATHS[view.name] = list(view.access_paths)
+    return view
+
 
 # MarkoView V1: Advisor and Student co-authorship
-def create_view_v1():
-    view_v1_sql = """
-        CREATE OR REPLACE VIEW V1 AS
-        SELECT 
-            a.aid1, 
-            a.aid2, 
-            CAST(COUNT(w1.pid) AS FLOAT) / 2 AS weight  -- Calculate weight based on co-authored publications during the student period
+register_markoview(MarkoView(
+    "V1", "nv1",
+    keys={"aid1": "a.aid1", "aid2": "a.aid2"},
+    # Weight based on co-authored publications during the student period
+    weight="CAST(COUNT(w1.pid) AS FLOAT) / 2",
+    body="""
         FROM 
             Advisorp a
         JOIN 
@@ -22,45 +108,104 @@ def create_view_v1():
         WHERE 
             p.year = s.year  -- Only consider publications made during the year aid2 was a student
         GROUP BY 
-            a.aid1, a.aid2;
-        """
-    try:
-        session.execute(text(view_v1_sql))
-        session.commit()
-        print("V1 created successfully.")
-    except Exception as e:
-        session.rollback()
-        print(f"An error occurred while creating V1: {e}")
-
+            a.aid1, a.aid2
+        """,
+    atoms=[("advisorp", ("aid1", "aid2")), ("studentp", ("aid2",))],
+    indexes=[("aid2",)],
+    access_paths=[
+        ("advisorp", ("aid2",)),      # Studentp s ON a.aid2 = s.aid
+        ("studentp", ("aid",)),
+        ("wrote", ("aid", "pid")),    # Wrote w1/w2 ON a.aidN = w.aid, same pid
+        ("wrote", ("pid",)),
+        ("pub", ("pid",)),
+    ],
+))
 
 
 # MarkoView V2: Constraint on advisors advising two students who advise each other
-def create_view_v2():
-    try:
-        # Drop the view if it exists
-        session.execute(text("DROP VIEW IF EXISTS V2"))
-
-        # Create the view
-        view_v2_sql = """
-        CREATE VIEW V2 AS
-        SELECT 
-            a1.aid1, 
-            a1.aid2, 
-            a2.aid2 AS aid3,
-            0 AS weight  -- Set weight to 0 as per the paper's specification
+register_markoview(MarkoView(
+    "V2", "nv2",
+    keys={"aid1": "a1.aid1", "aid2": "a1.aid2", "aid3": "a2.aid2"},
+    weight="0",  # Set weight to 0 as per the paper's specification
+    body="""
         FROM 
             advisorp a1
         JOIN 
             advisorp a2 ON a1.aid1 = a2.aid1
         WHERE 
-            a1.aid2 <> a2.aid2;  -- Ensure aid2 and aid3 are distinct
-        """
-        session.execute(text(view_v2_sql))
-        session.commit()
-        print("V2 created successfully.")
-    except Exception as e:
-        session.rollback()
-        print(f"An error occurred while creating V2: {e}")
+            a1.aid2 <> a2.aid2  -- Ensure aid2 and aid3 are distinct
+        """,
+    atoms=[("advisorp", ("aid1", "aid2")), ("advisorp", ("aid1", "aid3"))],
+    indexes=[("aid1", "aid3")],
+    access_paths=[
+        ("advisorp", ("aid1",)),      # advisorp a2 ON a1.aid1 = a2.aid1
+    ],
+))
+
+
+# MarkoView V3: If two people have published a lot together recently, then their affiliations are very likely to be same
+register_markoview(MarkoView(
+    "V3", "nv3",
+    keys={"aid1": "a1.aid", "aid2": "a2.aid", "inst": "a1.inst"},
+    weight="COUNT(DISTINCT p.pid) / 5.0",
+    body="""
+        FROM 
+            Affiliation a1
+        JOIN 
+            Affiliation a2 ON a1.inst = a2.inst AND a1.aid <> a2.aid
+        JOIN 
+            Wrote w1 ON a1.aid = w1.aid
+        JOIN 
+            Wrote w2 ON a2.aid = w2.aid AND w1.pid = w2.pid
+        JOIN 
+            Pub p ON p.pid = w1.pid
+        WHERE 
+            p.year > 2004
+            --AND a1.aid <> a2.aid  -- Exclude self-pairing
+        GROUP BY 
+            a1.aid, a2.aid, a1.inst
+        HAVING 
+            COUNT(DISTINCT p.pid) > 2 -- Filter only those pairs with more than 2 co-publications
+        """,
+    indexes=[("aid2",)],
+    access_paths=[
+        ("affiliation", ("inst",)),   # Affiliation a2 ON a1.inst = a2.inst
+        ("wrote", ("aid", "pid")),    # Wrote w2 ON a2.aid = w2.aid AND w1.pid = w2.pid
+        ("wrote", ("pid",)),
+        ("pub", ("pid",)),
+        ("pub", ("year",)),           # p.year > 2004
+    ],
+))
+
+
+@instrumented
+def create_markoview(name, materialized=False, session=None):
+    with session_scope(session) as session:
+        try:
+            _create_markoview(session, name, materialized)
+            session.commit()
+            print(f"{name} created successfully.")
+        except Exception as e:
+            session.rollback()
+            print(f"An error occurred while creating {name}: {e}")
+
+
+def create_markoviews(materialized=False, session=None):
+    # Every registered MarkoView
+    for name in MARKOVIEWS:
+        create_markoview(name, materialized, session)
+
+
+def create_view_v1(materialized=False, session=None):
+    create_markoview("V1", materialized, session)
+
+
+def create_view_v2(materialized=False, session=None):
+    create_markoview("V2", materialized, session)
+
+
+def create_view_v3(materialized=False, session=None):
+    create_markoview("V3", materialized, session)
 
 #lets break down V3 to ensure correct answer:
 # def check_coauthorships():
@@ -120,47 +265,94 @@ def create_view_v2():
 # debug_v3_query()
 
 
-# MarkoView V3: If two people have published a lot together recently, then their affiliations are very likely to be same
-def create_view_v3():
-    view_v3_sql = """
-                        CREATE OR REPLACE VIEW V3 AS
-        SELECT 
-            a1.aid AS aid1,
-            a2.aid AS aid2,
-            a1.inst AS inst,
-            COUNT(DISTINCT p.pid) / 5.0 AS weight
-        FROM 
-            Affiliation a1
-        JOIN 
-            Affiliation a2 ON a1.inst = a2.inst AND a1.aid <> a2.aid
-        JOIN 
-            Wrote w1 ON a1.aid = w1.aid
-        JOIN 
-            Wrote w2 ON a2.aid = w2.aid AND w1.pid = w2.pid
-        JOIN 
-            Pub p ON p.pid = w1.pid
-        WHERE 
-            p.year > 2004
-            --AND a1.aid <> a2.aid  -- Exclude self-pairing
-        GROUP BY 
-            a1.aid, a2.aid, a1.inst
-        HAVING 
-            COUNT(DISTINCT p.pid) > 2; -- Filter only those pairs with more than 2 co-publications
+def _relation_kind(session, name):
+    # pg_class.relkind of a relation: 'v' for a view, 'm' for a materialized view, 'r' for a
+    # table, 'p' for a partitioned table, None if missing.
+    # SQLite has no materialized views; they are stored as tables of the same name
+    if is_sqlite(session):
+        kind = session.execute(
+            text("SELECT type FROM sqlite_master WHERE lower(name) = :name AND type IN ('view', 'table')"),
+            {"name": name.lower()}
+        ).scalar()
+        return {"view": "v", "table": "m"}.get(kind)
+    return session.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)"), {"name": name.lower()}
+    ).scalar()
+
+
+def _create_markoview(session, view, materialized=False):
+    # (Re)create a MarkoView as a plain view, or as a materialized view with a unique index on
+    # its key columns and its declared secondary indexes. The unique index serves keyed lookups
+    # and is required by REFRESH ... CONCURRENTLY
+    kind = _relation_kind(session, view)
+    sqlite = is_sqlite(session)
+    if kind == "m":
+        session.execute(text(f"DROP {'TABLE' if sqlite else 'MATERIALIZED VIEW'} {view}"))
+    elif kind is not None:
+        session.execute(text(f"DROP VIEW {view}"))
+
+    if materialized:
+        keys = ", ".join(_view_keys(view))
+        session.execute(text(f"CREATE {'TABLE' if sqlite else 'MATERIALIZED VIEW'} {view} AS {VIEW_SQL[view]}"))
+        session.execute(text(f"CREATE UNIQUE INDEX {view}_key ON {view} ({keys})"))
+        for columns in MARKOVIEWS[view].indexes:
+            session.execute(text(f"CREATE INDEX {view}_{'_'.join(columns)} ON {view} ({', '.join(columns)})"))
+        session.execute(text(f"ANALYZE {view}"))
+    else:
+        session.execute(text(f"CREATE VIEW {view} AS {VIEW_SQL[view]}"))
+
+
+def _view_keys(view):
+    return MARKOVIEWS[view].key_columns
+
+
+@instrumented
+def refresh_markoviews(concurrently=True, session=None):
+    # Recompute the stored results of the MarkoViews created with materialized=True (plain
+    # views are skipped). A concurrent refresh builds the new contents next to the old ones
+    # and only takes a lock that still allows SELECTs, so readers are never blocked. Each view
+    # is committed separately to keep that lock short. On SQLite the stored table is refilled
+    # in one transaction instead
+    refreshed = []
+    with session_scope(session) as session:
+        for view in VIEW_SQL:
+            if _relation_kind(session, view) != "m":
+                continue
+            option = " CONCURRENTLY" if concurrently else ""
+            try:
+                if is_sqlite(session):
+                    session.execute(text(f"DELETE FROM {view}"))
+                    session.execute(text(f"INSERT INTO {view} {VIEW_SQL[view]}"))
+                else:
+                    session.execute(text(f"REFRESH MATERIALIZED VIEW{option} {view}"))
+                session.commit()
+                refreshed.append(view)
+            except Exception as e:
+                session.rollback()
+                print(f"An error occurred while refreshing {view}: {e}")
+    print(f"Refreshed materialized MarkoViews: {', '.join(refreshed) or 'none'}")
+    return refreshed
+
+# Check the base tables for indexes backing the MarkoView joins and report the missing ones
+def check_view_indexes(session=None):
+    report = {}
+    with session_scope(session) as session:
+        for view, paths in VIEW_ACCESS_PATHS.items():
+            report[view] = missing_indexes(paths, session.connection())
+    for view, missing in report.items():
+        for table, columns in missing:
+            print(f"{view}: no index on {table}({', '.join(columns)}); lookups on it fall back to a sequential scan")
+    if not any(report.values()):
+        print("All MarkoView join keys are indexed.")
+    return report
 
-        """
-    try:
-        session.execute(text(view_v3_sql))
-        session.commit()
-        print("V3 created successfully.")
-    except Exception as e:
-        session.rollback()
-        print(f"An error occurred while creating V3: {e}")
 
 # Function to check for rule violation in MarkoView V2
-def enforce_constraint_v2():
+def enforce_constraint_v2(session=None):
     try:
         # Execute the query to check for violations in V2
-        result = session.execute(text("SELECT * FROM V2")).fetchall()
+        with session_scope(session) as session:
+            result = session.execute(text("SELECT * FROM V2")).fetchall()
 
         # Check if there are any results
         if not result:
@@ -186,9 +378,10 @@ def enforce_constraint_v2():
 
 
 # Query and display the results of MarkoView V1
-def show_view_v1():
+def show_view_v1(session=None):
     print("Querying MarkoView V1...")
-    result = session.execute(text("SELECT * FROM V1"))
+    with session_scope(session) as session:
+        result = session.execute(text("SELECT * FROM V1")).fetchall()
 
     # Initialize a flag to track if there are results
     has_results = False
@@ -204,22 +397,24 @@ def show_view_v1():
 
 
 # Query and display the results of MarkoView V2
-def show_view_v2():
-    result = session.execute(text("SELECT * FROM V2"))
+def show_view_v2(session=None):
+    with session_scope(session) as session:
+        result = session.execute(text("SELECT * FROM V2")).fetchall()
     print("MarkoView V2 (Advisor Violation Rule):")
     for row in result:
         print(f"Advisor {row.aid1} advises both {row.aid2} and {row.aid3}, violating the rule!")
 
 
 
-def show_view_v3():
+def show_view_v3(session=None):
     try:
         # Query the V3 view
         view_v3_sql = "SELECT aid1, aid2, inst, weight FROM V3"
-        result = session.execute(text(view_v3_sql))
+        with session_scope(session) as session:
+            result = session.execute(text(view_v3_sql)).fetchall()
 
         # Check if there are any results
-        if result.rowcount == 0:
+        if not result:
             print("No results found in V3.")
         else:
             print("MarkoView V3 (Co-authorship and Affiliation):")
@@ -230,204 +425,300 @@ def show_view_v3():
         print(f"An error occurred while querying V3: {e}")
 
 
+def nv_partition_name(nv_table, remainder):
+    return f"{nv_table}_p{remainder}"
+
+
 # Step 1: Define NV tables for each view
-def create_nv_tables():
+@instrumented
+def create_nv_tables(session=None, partitions=NV_PARTITIONS):
+    # partitions > 0 creates new NV tables hash-partitioned on aid1 into that many partitions
+    # (PostgreSQL), so keyed queries on aid1 only read one partition per view and rebuilds and
+    # vacuum can work partition by partition (see app.partitions). Existing tables keep
+    # their layout
     metadata = MetaData()
-
-    # Define NV1 table (based on V1)
-    nv1 = Table(
-        'nv1', metadata,
-        Column('aid1', Integer, primary_key=True),
-        Column('aid2', Integer, primary_key=True),
-        Column('weight', Float),
-        Column('w_0', Float)
+    with session_scope(session) as session:
+        if partitions and is_sqlite(session):
+            print("SQLite has no table partitioning; NV tables are created unpartitioned.")
+            partitions = 0
+        partitioned = {view.nv_table: bool(partitions) and NV_PARTITION_KEY in view.keys
+                                      and _relation_kind(session, view.nv_table) in (None, "p")
+                       for view in MARKOVIEWS.values()}
+    nv_tables = [view.nv_table_definition(metadata, partitioned[view.nv_table]) for view in MARKOVIEWS.values()]
+
+    # Single-row data-version stamp, bumped whenever the content of the NV tables changes
+    Table(
+        'nv_version', metadata,
+        Column('id', Integer, primary_key=True),
+        Column('version', Integer)
     )
 
-    # Define NV2 Table (based on V2)
-    nv2 = Table(
-        'nv2', metadata,
-        Column('aid1', Integer, primary_key=True),
-        Column('aid2', Integer, primary_key=True),
-        Column('aid3', Integer, primary_key=True),
-        Column('weight', Float),
-        Column('w_0', Float)
-    )
+    # Create all tables in the database, and the indexes of NV tables that already existed
+    with session_scope(session) as session:
+        connection = session.connection()
+        metadata.create_all(connection)
+        for nv_table in nv_tables:
+            if partitioned[nv_table.name]:
+                for remainder in range(partitions):
+                    connection.execute(text(
+                        f"CREATE TABLE IF NOT EXISTS {nv_partition_name(nv_table.name, remainder)} "
+                        f"PARTITION OF {nv_table.name} FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})"
+                    ))
+            elif partitions:
+                print(f"{nv_table.name} is not partitioned: it already existed or has no {NV_PARTITION_KEY} key.")
+            for index in nv_table.indexes:
+                index.create(connection, checkfirst=True)
+        session.commit()
 
-    # Define NV3 table (based on V3)
-    nv3 = Table(
-        'nv3', metadata,
-        Column('aid1', Integer, primary_key=True),
-        Column('aid2', Integer, primary_key=True),
-        Column('inst', String),  # Corrected to use String instead of string
-        Column('weight', Float),
-        Column('w_0', Float)
-    )
 
-    # Create all tables in the database
-    metadata.create_all(engine)
+# ---------------- NV data version -------------------
+
+# Cached P0(W) per (database, clamp) (clamp None for compute_P0_W, EPSILON for m_compute_P0_W)
+# -> (version, value). Databases are told apart by app.dialects.database_key
+_P0_W_CACHE = {}
+
+
+NV_VERSION_SQL = "SELECT version FROM nv_version WHERE id = 1"
+
+
+def get_nv_version(session):
+    # Current data version of the NV tables (0 if they were never populated)
+    return session.execute(text(NV_VERSION_SQL)).scalar() or 0
+
+
+def bump_nv_version(session):
+    # Called in the same transaction as the change to the NV tables, so readers never see
+    # new NV content under an old version. The cached results of this database are dropped
+    # when the transaction commits, not before, so no reader caches the old version again
+    session.execute(text("""
+        INSERT INTO nv_version (id, version) VALUES (1, 1)
+        ON CONFLICT (id) DO UPDATE SET version = nv_version.version + 1
+    """))
+    RESULT_CACHE.invalidate_on_commit(session)
+
+def _w0_sql(weight):
+    # MVDB -> INDB weight transformation w_0 = (1 - weight) / weight. A weight of 0 marks a
+    # constraint tuple and maps to w_0 = 0; a NULL weight yields a NULL w_0, which the
+    # probability aggregates skip
+    return f"CASE WHEN {weight} = 0 THEN 0 ELSE (1 - {weight}) / {weight} END"
+
+
+def _populate_nv_table(session, nv_table, view, keys):
+    # One INSERT ... SELECT per view; tuples already present in the NV table are skipped
+    # by ON CONFLICT instead of a duplicate-check SELECT per row. w_0 is computed on insert
+    # so transform_mvdb_to_indb() does not have to rewrite the fresh rows
+    columns = ", ".join(keys + ("weight",))
+    if is_sqlite(session):
+        # No DML in CTEs: count the source, then insert (WHERE TRUE keeps the parser from
+        # reading ON CONFLICT as a join constraint)
+        total = session.execute(text(f"SELECT COUNT(*) FROM {view}")).scalar()
+        inserted = session.execute(text(f"""
+            INSERT INTO {nv_table} ({columns}, w_0)
+            SELECT {columns}, {_w0_sql("CAST(weight AS FLOAT)")} FROM {view} WHERE TRUE
+            ON CONFLICT DO NOTHING
+        """)).rowcount
+        return inserted, total - inserted
+    populate_sql = f"""
+        WITH source AS (
+            SELECT {columns} FROM {view}
+        ), inserted AS (
+            INSERT INTO {nv_table} ({columns}, w_0)
+            SELECT {columns}, {_w0_sql("CAST(weight AS FLOAT)")} FROM source
+            ON CONFLICT DO NOTHING
+            RETURNING 1
+        )
+        SELECT
+            (SELECT COUNT(*) FROM source) AS total,
+            (SELECT COUNT(*) FROM inserted) AS inserted
+    """
+    row = session.execute(text(populate_sql)).one()
+    return row.inserted, row.total - row.inserted
+
 
 # Step 2: Populate NV tables based on the views
-def populate_nv_tables():
-    # Populate NV1 based on V1
-    v1_tuples = session.execute(text("SELECT aid1, aid2, weight FROM V1"))
-    for row in v1_tuples:
-        # Check if the tuple already exists in nv1
-        existing = session.execute(
-            text("SELECT aid1, aid2 FROM nv1 WHERE aid1 = :aid1 AND aid2 = :aid2"),
-            {"aid1": row.aid1, "aid2": row.aid2}
-        ).fetchone()
-
-        if existing is None:
-            session.execute(
-                text("INSERT INTO nv1 (aid1, aid2, weight) VALUES (:aid1, :aid2, :weight)"),
-                {"aid1": row.aid1, "aid2": row.aid2, "weight": row.weight}
-            )
-        else:
-            print(f"Skipping duplicate entry for aid1={row.aid1}, aid2={row.aid2} in nv1")
-
-    # Populate NV2 based on V2
-    v2_tuples = session.execute(text("SELECT aid1, aid2, aid3, weight FROM V2"))
-    for row in v2_tuples:
-        # Check if the tuple already exists in nv2
-        existing = session.execute(
-            text("SELECT aid1, aid2, aid3 FROM nv2 WHERE aid1 = :aid1 AND aid2 = :aid2 AND aid3 = :aid3"),
-            {"aid1": row.aid1, "aid2": row.aid2, "aid3": row.aid3}
-        ).fetchone()
-
-        if existing is None:
-            session.execute(
-                text("INSERT INTO nv2 (aid1, aid2, aid3, weight) VALUES (:aid1, :aid2, :aid3, :weight)"),
-                {"aid1": row.aid1, "aid2": row.aid2, "aid3": row.aid3, "weight": row.weight}
-            )
-        else:
-            print(f"Skipping duplicate entry for aid1={row.aid1}, aid2={row.aid2}, aid3={row.aid3} in nv2")
-
-    # Populate NV3 based on V3
-    v3_tuples = session.execute(text("SELECT aid1, aid2, inst, weight FROM V3"))
-    for row in v3_tuples:
-        # Check if the tuple already exists in nv3
-        existing = session.execute(
-            text("SELECT aid1, aid2, inst FROM nv3 WHERE aid1 = :aid1 AND aid2 = :aid2 AND inst = :inst"),
-            {"aid1": row.aid1, "aid2": row.aid2, "inst": row.inst}
-        ).fetchone()
-
-        if existing is None:
-            session.execute(
-                text("INSERT INTO nv3 (aid1, aid2, inst, weight) VALUES (:aid1, :aid2, :inst, :weight)"),
-                {"aid1": row.aid1, "aid2": row.aid2, "inst": row.inst, "weight": row.weight}
-            )
-        else:
-            print(f"Skipping duplicate entry for aid1={row.aid1}, aid2={row.aid2}, inst={row.inst} in nv3")
-
-    session.commit()
+@instrumented
+def populate_nv_tables(session=None):
+    counts = {}
+    with session_scope(session) as session:
+        for nv_table, (view, keys) in NV_SOURCES.items():
+            inserted, skipped = _populate_nv_table(session, nv_table, view, keys)
+            counts[nv_table] = {"inserted": inserted, "skipped": skipped}
+            print(f"{nv_table}: inserted {inserted} tuples, skipped {skipped} duplicates")
+
+        if any(count["inserted"] for count in counts.values()):
+            bump_nv_version(session)
+        session.commit()
     print("NV tables populated successfully.")
+    return counts
+
+
+@instrumented
+def transform_mvdb_to_indb(session=None):
+    # One UPDATE per NV table; rows whose w_0 is already up to date (e.g. filled in
+    # by populate_nv_tables) are left untouched
+    counts = {}
+    with session_scope(session) as session:
+        for nv_table in NV_SOURCES:
+            w0 = _w0_sql("weight")
+            result = session.execute(text(
+                f"UPDATE {nv_table} SET w_0 = {w0} WHERE {distinct_sql(session, 'w_0', w0)}"
+            ))
+            counts[nv_table] = result.rowcount
+
+        if any(counts.values()):
+            bump_nv_version(session)
+        session.commit()
+    print("Transformation to INDB complete.")
+    return counts
 
+# ---------------- Computing the P(Q) -------------------
 
-def transform_mvdb_to_indb():
-    # Transform NV1 tuples
-    nv1_tuples = session.execute(text("SELECT aid1, aid2, weight FROM nv1"))
-    for row in nv1_tuples:
-        # Apply the transformation logic
-        transformed_weight = (1 - row.weight) / row.weight
-        session.execute(
-            text("UPDATE nv1 SET w_0 = :w_0 WHERE aid1 = :aid1 AND aid2 = :aid2"),
-            {"aid1": row.aid1, "aid2": row.aid2, "w_0": transformed_weight}
-        )
+EPSILON = 1e-10  # Clamp used by the m_ variants to keep w_0 strictly inside (0, 1)
 
-    # Transform NV2 tuples
-    nv2_tuples = session.execute(text("SELECT aid1, aid2, aid3, weight FROM nv2"))
-    for row in nv2_tuples:
-        # Check if the weight is 0 (indicating a constraint)
-        if row.weight == 0:
-            transformed_weight = 0  # Directly set w_0 to 0 for constraint tuples
-        else:
-            # Apply the transformation logic for non-constraint tuples
-            transformed_weight = (1 - row.weight) / row.weight
 
-        session.execute(
-            text("UPDATE nv2 SET w_0 = :w_0 WHERE aid1 = :aid1 AND aid2 = :aid2 AND aid3 = :aid3"),
-            {"aid1": row.aid1, "aid2": row.aid2, "aid3": row.aid3, "w_0": transformed_weight}
-        )
+def _nv_w0_sql(query=None):
+    # w_0 of every NV tuple (optionally restricted by a condition) as one UNION ALL.
+    # A Predicate compiles to bound parameters and skips NV tables lacking its columns;
+    # a plain string condition is spliced into every SELECT as before
+    if isinstance(query, Predicate):
+        where, params = query.compile()
+        selects = [f"SELECT w_0 FROM {nv_table} WHERE {where}"
+                   for nv_table, (_, keys) in NV_SOURCES.items() if query.applies_to(keys)]
+        if not selects:
+            selects = ["SELECT CAST(NULL AS FLOAT) AS w_0 WHERE FALSE"]
+    else:
+        where, params = (f" WHERE {query}" if query else ""), {}
+        selects = [f"SELECT w_0 FROM {nv_table}{where}" for nv_table in NV_SOURCES]
+    return "\n        UNION ALL\n        ".join(selects), params
+
+
+_PLACEHOLDER = re.compile(r"(?<![:\w]):(\w+)")
+
+
+def _execute_prepared(session, sql, params):
+    # On PostgreSQL, run the statement through a server-side prepared plan that is created
+    # once per connection and reused by every later call with the same SQL text
+    if session.get_bind().dialect.name != "postgresql":
+        return session.execute(text(sql), params)
+    connection = session.connection()
+    prepared = connection.info.setdefault("markoviews_prepared", set())
+    names = list(dict.fromkeys(_PLACEHOLDER.findall(sql)))
+    statement = "mv_" + hashlib.md5(sql.encode()).hexdigest()[:16]
+    if statement not in prepared:
+        positional_sql = _PLACEHOLDER.sub(lambda match: f"${names.index(match.group(1)) + 1}", sql)
+        connection.execute(text(f"PREPARE {statement} AS {positional_sql}"))
+        prepared.add(statement)
+    arguments = f"({', '.join(f':{name}' for name in names)})" if names else ""
+    return connection.execute(text(f"EXECUTE {statement}{arguments}"), params)
+
+
+def _complement_from_log(log_abs, n_negative, n_zero):
+    # 1 - prod(1 - w_0), rebuilt from sum(log|1 - w_0|) and the number of negative factors
+    if n_zero:
+        return 1.0
+    sign = -1 if n_negative % 2 else 1
+    try:
+        product = math.exp(log_abs)
+    except OverflowError:
+        product = math.inf
+    return 1 - sign * product
+
+
+def _log_aggregates_sql(clamp=None, w_0="w_0", prefix=""):
+    # Push 1 - prod(1 - w_0) into the database as a sum of logs so only one row per group
+    # comes back. Negative factors (w_0 > 1) are counted to restore the sign, zero factors
+    # (w_0 = 1) are counted instead of taking log(0), and NULL w_0 values are ignored.
+    # prefix is prepended to the output column names when a query needs several aggregates
+    if clamp is None:
+        factor, params = f"1 - {w_0}", {}
+    else:
+        factor, params = f"1 - LEAST(GREATEST({w_0}, :eps), 1 - :eps)", {"eps": clamp}
+    aggregates_sql = f"""
+            COALESCE(SUM(CASE WHEN {w_0} <> 1 THEN LN(ABS({factor})) END), 0) AS {prefix}log_abs,
+            COUNT(CASE WHEN {factor} < 0 AND {w_0} <> 1 THEN 1 END) AS {prefix}n_negative,
+            COUNT(CASE WHEN {w_0} = 1 THEN 1 END) AS {prefix}n_zero"""
+    return aggregates_sql, params
+
+
+def _aggregate_P0_sql(query=None, clamp=None):
+    # Single-row aggregate (log_abs, n_negative, n_zero) over the selected NV tuples; shared
+    # by the synchronous functions below and by app.async_queries
+    aggregates_sql, params = _log_aggregates_sql(clamp)
+    nv_sql, query_params = _nv_w0_sql(query)
+    params.update(query_params)
+    aggregate_sql = f"""
+        SELECT {aggregates_sql}
+        FROM (
+        {nv_sql}
+        ) AS nv
+    """
+    return aggregate_sql, params
 
-    # Transform NV3 tuples
-    nv3_tuples = session.execute(text("SELECT aid1, aid2, inst, weight FROM nv3"))
-    for row in nv3_tuples:
-        if row.weight == 0:
-            # Handle the edge case where weight is zero (constraint tuple)
-            transformed_weight = 0  # or handle in a specific way as per your requirements
-        else:
-            # Apply the transformation logic
-            transformed_weight = (1 - row.weight) / row.weight
 
-        session.execute(
-            text("UPDATE nv3 SET w_0 = :w_0 WHERE aid1 = :aid1 AND aid2 = :aid2 AND inst = :inst"),
-            {"aid1": row.aid1, "aid2": row.aid2, "inst": row.inst, "w_0": transformed_weight}
-        )
+def _aggregate_P0(session, query=None, clamp=None):
+    aggregate_sql, params = _aggregate_P0_sql(query, clamp)
+    if isinstance(query, str):
+        # Free-form conditions produce a new SQL text per call and are not worth preparing
+        row = session.execute(text(aggregate_sql), params).one()
+    else:
+        row = _execute_prepared(session, aggregate_sql, params).one()
+    return _complement_from_log(row.log_abs, row.n_negative, row.n_zero)
 
-    session.commit()
 
-    session.commit()
-    print("Transformation to INDB complete.")
+def _cached_P0_W(session, clamp=None):
+    # P0(W) does not depend on the query, so it is computed once per NV data version
+    version = get_nv_version(session)
+    key = (database_key(session), clamp)
+    cached = _P0_W_CACHE.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    value = _aggregate_P0(session, clamp=clamp)
+    _P0_W_CACHE[key] = (version, value)
+    return value
 
-# ---------------- Computing the P(Q) -------------------
 
+@instrumented
 def compute_P0_Q_or_W(session, query):
-    prob_product = 1
-    query_sql = f"""
-        SELECT w_0 FROM nv1 WHERE {query}
-        UNION ALL
-        SELECT w_0 FROM nv2 WHERE {query}
-        UNION ALL
-        SELECT w_0 FROM nv3 WHERE {query}
-    """
-    result = session.execute(text(query_sql)).fetchall()
-
-    # Calculate the product of (1 - w_0) for each tuple's probability
-    for row in result:
-        weight = row[0]
-        print(f"Processing tuple with w_0 = {weight}, current product = {prob_product}")
-        prob_product *= (1 - weight)
-        print(f"Updated product = {prob_product}")
-
-    total_probability = 1 - prob_product
-    print(f"Final computed probability (P0_Q_or_W) = {total_probability}")
+    # 1 - product of (1 - w_0) over the tuples selected by the query, given either as a
+    # Predicate (e.g. eq("aid1", 1) & eq("aid2", 2)) or as a raw SQL condition string
+    with session_scope(session) as session:
+        total_probability = _aggregate_P0(session, query)
+    logger.debug("P0(Q or W) = %s", total_probability)
     return total_probability
 
 
-
+@instrumented
 def compute_P0_W(session):
-    # Initialize probability product for independent events
-    prob_product = 1
-    epsilon = 1e-10  # Small value to handle edge cases
-
-    # Direct probabilities of tuples from NV tables
-    query_sql = """
-        SELECT w_0 FROM nv1
-        UNION ALL
-        SELECT w_0 FROM nv2
-        UNION ALL
-        SELECT w_0 FROM nv3
-    """
-    result = session.execute(text(query_sql)).fetchall()
-
-    # Compute the product of (1 - w_0) for each tuple's probability
-    for row in result:
-        weight = row[0]
-        # Include negative weights as they are
-        prob_product *= (1 - weight)
-
-    # Compute the final probability using the complement
-    total_probability = 1 - prob_product
+    # 1 - product of (1 - w_0) over all NV tuples; negative weights are included as they are.
+    # Cached per NV data version, so repeated compute_PQ calls do not rescan the NV tables
+    with session_scope(session) as session:
+        total_probability = _cached_P0_W(session)
+    logger.debug("P0(W) = %s", total_probability)
     return total_probability
 
 
+@instrumented
 def compute_PQ(session, query):
-    # Compute P0(Q or W)
-    P0_Q_or_W = compute_P0_Q_or_W(session, query)
+    # session may be None to evaluate the query on a pooled session of its own. Results are
+    # cached per NV data version (app.result_cache)
+    with session_scope(session) as session:
+        key = RESULT_CACHE.key(session, "PQ", query, lambda: get_nv_version(session))
+        PQ = RESULT_CACHE.get(key)
+        if PQ is not None:
+            return PQ
 
-    # Compute P0(W) - the union of all NV tables
-    P0_W = compute_P0_W(session)
+        # Compute P0(Q or W)
+        P0_Q_or_W = compute_P0_Q_or_W(session, query)
 
+        # Compute P0(W) - the union of all NV tables
+        P0_W = compute_P0_W(session)
+
+    PQ = _PQ(P0_Q_or_W, P0_W)
+    RESULT_CACHE.put(key, PQ)
+    return PQ
+
+
+def _PQ(P0_Q_or_W, P0_W):
     # Apply the formula to calculate the final probability P(Q)
     if P0_W >= 1:  # Avoid division by zero and handle edge cases
         return 1.0
@@ -436,15 +727,74 @@ def compute_PQ(session, query):
         return PQ
 
 
+def _batch_P0_Q_or_W(session, keys, columns, clamp=None):
+    # P0(Q or W) for every key in one grouped scan of the NV tables. The keys are bound as
+    # one array per column, deduplicated, and left-joined to the NV tuples, so keys without
+    # any matching tuple still come back (with P0 = 0). NV tables that lack one of the key
+    # columns cannot match and are left out of the scan, an empty select if none has them all
+    keys = list(keys)
+    columns = tuple(columns)
+    selects = [f"SELECT {', '.join(columns)}, w_0 FROM {nv_table}"
+               for nv_table, (_, nv_keys) in NV_SOURCES.items() if set(columns) <= set(nv_keys)]
+    if not selects:
+        null_columns = ", ".join(f"CAST(NULL AS {nv_key_sql_type(column)}) AS {column}" for column in columns)
+        selects = [f"SELECT {null_columns}, CAST(NULL AS FLOAT) AS w_0 WHERE FALSE"]
+    nv_sql = "\n            UNION ALL\n            ".join(selects)
+    keys_sql = unnest_sql(session, [f"k{i}" for i in range(len(columns))], columns,
+                          [nv_key_sql_type(column) for column in columns])
+    join_sql = " AND ".join(f"nv.{column} = keys.{column}" for column in columns)
+    key_columns_sql = ", ".join(f"keys.{column}" for column in columns)
+    aggregates_sql, params = _log_aggregates_sql(clamp, w_0="nv.w_0")
+    params.update(bind_arrays(session, {f"k{i}": [key[i] for key in keys] for i in range(len(columns))}))
+
+    batch_sql = f"""
+        WITH keys AS (
+            SELECT DISTINCT * FROM ({keys_sql}) AS k
+        ), nv AS (
+            {nv_sql}
+        )
+        SELECT {key_columns_sql}, {aggregates_sql}
+        FROM keys
+        LEFT JOIN nv ON {join_sql}
+        GROUP BY {key_columns_sql}
+    """
+    result = session.execute(text(batch_sql), params, execution_options={"stream_results": True})
+    for row in result:
+        yield tuple(row[:len(columns)]), _complement_from_log(row.log_abs, row.n_negative, row.n_zero)
+
+
+def compute_PQ_batch(session, keys, columns=("aid1", "aid2")):
+    # P(Q) for many keyed conditions at once, e.g. keys=[(1, 2), (1, 3)] is equivalent to
+    # compute_PQ for "aid1 = 1 AND aid2 = 2" and "aid1 = 1 AND aid2 = 3". Yields
+    # (key, probability) pairs as the grouped scan produces them, in no particular order
+    with session_scope(session) as session:
+        P0_W = compute_P0_W(session)
+        for key, P0_Q_or_W in _batch_P0_Q_or_W(session, keys, columns):
+            yield key, _PQ(P0_Q_or_W, P0_W)
+
+
 # -------------------------- Revised Contribution ----------
 
+@instrumented
 def m_compute_PQ(session, query):
-    # Compute P0(Q or W)
-    m_P0_Q_or_W = m_compute_P0_Q_or_W(session, query)
+    with session_scope(session) as session:
+        key = RESULT_CACHE.key(session, "m_PQ", query, lambda: get_nv_version(session))
+        m_PQ = RESULT_CACHE.get(key)
+        if m_PQ is not None:
+            return m_PQ
+
+        # Compute P0(Q or W)
+        m_P0_Q_or_W = m_compute_P0_Q_or_W(session, query)
+
+        # Compute P0(W) - the union of all NV tables
+        m_P0_W = m_compute_P0_W(session)
+
+    m_PQ = _m_PQ(m_P0_Q_or_W, m_P0_W)
+    RESULT_CACHE.put(key, m_PQ)
+    return m_PQ
 
-    # Compute P0(W) - the union of all NV tables
-    m_P0_W = m_compute_P0_W(session)
 
+def _m_PQ(m_P0_Q_or_W, m_P0_W):
     # Avoid division by zero, ensure m_P0_W is not exactly 1
     if m_P0_W >= 1:
         m_P0_W = 0.999999  # Small adjustment to avoid division by zero
@@ -453,56 +803,23 @@ def m_compute_PQ(session, query):
     m_PQ = (m_P0_Q_or_W - m_P0_W) / (1 - m_P0_W)
     return m_PQ
 
-def m_compute_P0_Q_or_W(session, query):
-    # Initialize probability product for independent events
-    prob_product = 1
-    epsilon = 1e-10  # Small value to handle edge cases
-
-    # Direct probabilities of tuples from NV tables
-    query_sql = f"""
-        SELECT w_0 FROM nv1 WHERE {query}
-        UNION ALL
-        SELECT w_0 FROM nv2 WHERE {query}
-        UNION ALL
-        SELECT w_0 FROM nv3 WHERE {query}
-    """
-    result = session.execute(text(query_sql)).fetchall()
 
-    # Check for any tuple with w_0 = 1 (certainty)
-    for row in result:
-        weight = row[0]
-        if weight == 1:
-            return 1  # If any tuple is certain, return probability 1 immediately
-        # Otherwise, multiply (1 - weight)
-        prob_product *= (1 - min(max(weight, epsilon), 1 - epsilon))
-
-    # Compute the final probability using the complement
-    total_probability = 1 - prob_product
-    return total_probability
+def m_compute_PQ_batch(session, keys, columns=("aid1", "aid2")):
+    # Batch counterpart of m_compute_PQ, see compute_PQ_batch
+    with session_scope(session) as session:
+        m_P0_W = m_compute_P0_W(session)
+        for key, m_P0_Q_or_W in _batch_P0_Q_or_W(session, keys, columns, clamp=EPSILON):
+            yield key, _m_PQ(m_P0_Q_or_W, m_P0_W)
 
-def m_compute_P0_W(session):
-    # Initialize probability product for independent events
-    prob_product = 1
-    epsilon = 1e-10  # Small value to handle edge cases
-
-    # Direct probabilities of tuples from NV tables
-    query_sql = """
-        SELECT w_0 FROM nv1
-        UNION ALL
-        SELECT w_0 FROM nv2
-        UNION ALL
-        SELECT w_0 FROM nv3
-    """
-    result = session.execute(text(query_sql)).fetchall()
+@instrumented
+def m_compute_P0_Q_or_W(session, query):
+    # Any tuple with w_0 = 1 (certainty) gives probability 1; otherwise w_0 is clamped
+    # into [EPSILON, 1 - EPSILON] before multiplying (1 - w_0)
+    with session_scope(session) as session:
+        return _aggregate_P0(session, query, clamp=EPSILON)
 
-    # Check for any tuple with w_0 = 1 (certainty)
-    for row in result:
-        weight = row[0]
-        if weight == 1:
-            return 1  # If any tuple is certain, return probability 1 immediately
-        # Otherwise, multiply (1 - weight)
-        prob_product *= (1 - min(max(weight, epsilon), 1 - epsilon))
-
-    # Compute the final probability using the complement
-    total_probability = 1 - prob_product
-    return total_probability
\ No newline at end of file
+@instrumented
+def m_compute_P0_W(session):
+    # Same as m_compute_P0_Q_or_W over all NV tuples
+    with session_scope(session) as session:
+        return _cached_P0_W(session, clamp=EPSILON)
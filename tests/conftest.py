@@ -0,0 +1,45 @@
+import os
+import sys
+
+import pytest
+
+# The application is imported as in main.py: config.py from the repository root, app from src
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "src")]
+
+from sqlalchemy import text  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+
+@pytest.fixture
+def sqlite_instance():
+    # Factory of synthetic MVDB instances, each on its own in-memory SQLite database with the
+    # MarkoViews created and the NV tables populated; statements are run on the base tables
+    # first. Returns an open session, closed with its engine at teardown
+    from app.models import make_engine, create_tables
+    from app.generator import GeneratorConfig, generate_dblp_like
+    from app.views import create_markoviews, create_nv_tables, populate_nv_tables, transform_mvdb_to_indb
+
+    engines, sessions = [], []
+
+    def build(seed, scale=3000, statements=()):
+        engine = make_engine("sqlite://")
+        engines.append(engine)
+        create_tables(engine)
+        generate_dblp_like(GeneratorConfig.scaled(scale, seed=seed), bind=engine)
+        session = Session(engine)
+        sessions.append(session)
+        for statement in statements:
+            session.execute(text(statement))
+        session.commit()
+        create_markoviews(session=session)
+        create_nv_tables(session)
+        populate_nv_tables(session)
+        transform_mvdb_to_indb(session)
+        return session
+
+    yield build
+    for session in sessions:
+        session.close()
+    for engine in engines:
+        engine.dispose()
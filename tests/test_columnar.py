@@ -0,0 +1,26 @@
+import pytest
+from sqlalchemy import text
+
+from app import columnar
+from app.columnar import ColumnarINDB
+from app.predicates import eq
+from app.views import compute_PQ, compute_PQ_batch
+
+
+@pytest.mark.parametrize("max_packed_codes", [columnar.MAX_PACKED_CODES, 0])
+def test_columnar_matches_sql(sqlite_instance, monkeypatch, max_packed_codes):
+    # With MAX_PACKED_CODES = 0 every key index falls back to record codes, as it does when
+    # the key combinations of a table overflow an int64
+    monkeypatch.setattr(columnar, "MAX_PACKED_CODES", max_packed_codes)
+    session = sqlite_instance(7, scale=200)
+    keys = [tuple(row) for row in session.execute(text(
+        "SELECT aid1, aid2 FROM nv1 UNION SELECT aid1, aid2 FROM nv2 UNION SELECT aid1, aid2 FROM nv3"
+    ))] + [(-1, -2)]
+    indb = ColumnarINDB(session)
+
+    for aid1, aid2 in keys:
+        query = eq("aid1", aid1) & eq("aid2", aid2)
+        assert indb.compute_PQ(query) == pytest.approx(compute_PQ(session, query), abs=1e-9)
+    expected = dict(compute_PQ_batch(session, keys))
+    for key, PQ in indb.compute_PQ_batch(keys):
+        assert PQ == pytest.approx(expected[key], abs=1e-9)
@@ -0,0 +1,35 @@
+import pytest
+from sqlalchemy import text
+
+from app.lineage import LineageTooLarge, exact_compute_PQ
+from app.components import build_component_index, component_compute_PQ
+from app.predicates import eq
+
+# Some base tuples are made certain: substituting them absorbs clauses across the parts of W
+CERTAIN_BASE_TUPLES = (
+    "UPDATE advisorp SET probability = 1.0 WHERE (aid1 + aid2) % 3 = 0",
+    "UPDATE studentp SET probability = 1.0 WHERE aid % 4 = 0",
+)
+
+
+def _evaluate(function, session, query):
+    try:
+        return function(session, query)
+    except (ValueError, LineageTooLarge) as error:
+        return type(error)
+
+
+@pytest.mark.parametrize("seed", [7, 11])
+def test_component_compute_PQ_matches_exact_compute_PQ(sqlite_instance, seed):
+    session = sqlite_instance(seed, statements=CERTAIN_BASE_TUPLES)
+    build_component_index(session)
+    keys = session.execute(text("SELECT aid1, aid2 FROM nv1 UNION SELECT aid1, aid2 FROM nv2")).all()
+    assert keys
+    for aid1, aid2 in keys:
+        query = eq("aid1", aid1) & eq("aid2", aid2)
+        exact = _evaluate(exact_compute_PQ, session, query)
+        component = _evaluate(component_compute_PQ, session, query)
+        if isinstance(exact, float):
+            assert component == pytest.approx(exact, abs=1e-12), (aid1, aid2)
+        else:
+            assert component is exact, (aid1, aid2)
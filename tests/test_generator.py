@@ -0,0 +1,11 @@
+import pytest
+
+from app.generator import GeneratorConfig, _Dataset
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_two_authors(seed):
+    # With two authors a student has only one possible advisor, whatever max_advisors_per_student
+    dataset = _Dataset(GeneratorConfig(n_authors=2, n_papers=5, seed=seed))
+    assert len(dataset.edges) == 1
+    assert all(advisor != student for advisor, student in dataset.edges)
@@ -0,0 +1,78 @@
+import pytest
+from sqlalchemy import text
+
+from app.incremental import refresh_nv_incremental
+from app.views import NV_SOURCES, VIEW_SQL, create_markoviews, populate_nv_tables, transform_mvdb_to_indb
+from app.dialects import truncate_sql
+
+
+def _nv_rows(session):
+    rows = {}
+    for nv_table, (_, keys) in NV_SOURCES.items():
+        result = session.execute(text(f"SELECT {', '.join(keys)}, weight, w_0 FROM {nv_table}"))
+        rows[nv_table] = {tuple(row[:len(keys)]): (row.weight, row.w_0) for row in result}
+    return rows
+
+
+def _delta(session):
+    # An advisorp delete and insert, and wrote and studentp inserts that create new V1 groups
+    deleted_edge = session.execute(text("SELECT aid1, aid2 FROM advisorp ORDER BY aid1, aid2")).first()
+    student, year = session.execute(text("SELECT aid, year FROM studentp ORDER BY aid")).first()
+    advisor = session.execute(text(
+        "SELECT aid FROM author WHERE aid <> :student AND aid NOT IN "
+        "(SELECT aid1 FROM advisorp WHERE aid2 = :student) ORDER BY aid"
+    ), {"student": student}).scalar()
+    new_student = session.execute(text(
+        "SELECT aid FROM author WHERE aid NOT IN (SELECT aid FROM studentp) ORDER BY aid"
+    )).scalar()
+    pids = [row.pid for row in session.execute(text(
+        "SELECT pid FROM pub WHERE year = :year ORDER BY pid LIMIT 3"), {"year": year})]
+    # A new paper of an existing V1 pair, which only the pub and wrote deltas touch
+    pair = session.execute(text(
+        "SELECT nv1.aid1, nv1.aid2, s.year FROM nv1 JOIN studentp s ON s.aid = nv1.aid2 "
+        "WHERE :advisor NOT IN (nv1.aid1, nv1.aid2) AND :student NOT IN (nv1.aid1, nv1.aid2) "
+        "ORDER BY nv1.aid1, nv1.aid2"
+    ), {"advisor": advisor, "student": student}).first()
+    new_pid = session.execute(text("SELECT MAX(pid) + 1 FROM pub")).scalar()
+    inserted = {
+        "advisorp": [{"aid1": advisor, "aid2": student, "probability": 0.7},
+                     {"aid1": advisor, "aid2": new_student, "probability": 0.6}],
+        "studentp": [{"aid": new_student, "year": year, "probability": 0.8}],
+        "pub": [{"pid": new_pid, "year": pair.year}],
+        "wrote": [{"aid": aid, "pid": pid} for pid in pids for aid in (advisor, student, new_student)]
+        + [{"aid": pair.aid1, "pid": new_pid}, {"aid": pair.aid2, "pid": new_pid}],
+    }
+    deleted = {"advisorp": [{"aid1": deleted_edge.aid1, "aid2": deleted_edge.aid2}]}
+    return inserted, deleted
+
+
+@pytest.mark.parametrize("seed", [7, 11])
+def test_incremental_refresh_matches_rebuild(sqlite_instance, seed):
+    session = sqlite_instance(seed, scale=1000)
+    before = _nv_rows(session)
+    counts = refresh_nv_incremental(session, *_delta(session))
+    assert any(count["deleted"] or count["inserted"] for count in counts.values())
+    incremental = _nv_rows(session)
+    assert incremental != before
+
+    for statement in truncate_sql(session, NV_SOURCES):
+        session.execute(text(statement))
+    session.commit()
+    populate_nv_tables(session)
+    transform_mvdb_to_indb(session)
+    rebuilt = _nv_rows(session)
+
+    for nv_table in NV_SOURCES:
+        assert incremental[nv_table].keys() == rebuilt[nv_table].keys()
+        for key, (weight, w_0) in rebuilt[nv_table].items():
+            assert incremental[nv_table][key] == pytest.approx((weight, w_0))
+
+
+def test_incremental_refresh_updates_materialized_views(sqlite_instance):
+    session = sqlite_instance(7, scale=1000)
+    create_markoviews(materialized=True, session=session)
+    session.commit()
+    refresh_nv_incremental(session, *_delta(session))
+    for view, sql in VIEW_SQL.items():
+        stored = session.execute(text(f"SELECT * FROM {view}")).all()
+        assert sorted(stored) == sorted(session.execute(text(sql)).all())
@@ -0,0 +1,102 @@
+import itertools
+import math
+
+import pytest
+from sqlalchemy import text
+
+from app.lineage import build_lineage, exact_compute_PQ, conditional_probability, is_hierarchical, safe_plan
+from app.predicates import eq
+from app.views import MARKOVIEWS, PROBABILISTIC_TABLES
+
+# A hand-built instance small enough to enumerate every world of its 9 probabilistic base
+# tuples. Advisors 1 and 7 both advise students 2 and 3 (V1 tuples of weight 1.5, 0.5 and 1.0,
+# and V2 tuples of weight 0), student 3 is certain, student 5 has two advisors of its own
+# (V1 tuples of weight 0.5 and 1.0, a hierarchical query), and authors 1 and 2 share an
+# institution (V3 tuples)
+BASE_TABLES = ("wrote", "pub", "studentp", "advisorp", "affiliation", "author")
+HAND_BUILT = [f"DELETE FROM {table}" for table in BASE_TABLES] + [
+    "INSERT INTO author (aid, name) VALUES (1, 'a1'), (2, 'a2'), (3, 'a3'), (4, 'a4'), (5, 'a5'), (6, 'a6'), "
+    "(7, 'a7')",
+    "INSERT INTO pub (pid, year) VALUES (101, 2010), (102, 2010), (103, 2010), (104, 2010), (105, 2010), "
+    "(106, 2010), (107, 2010)",
+    "INSERT INTO wrote (aid, pid) VALUES (1, 101), (1, 102), (1, 103), (2, 101), (2, 102), (2, 103), "
+    "(1, 104), (3, 104), (4, 105), (5, 105), (6, 106), (6, 107), (5, 106), (5, 107), (7, 101), (7, 102)",
+    "INSERT INTO studentp (aid, year, probability) VALUES (2, 2010, 0.9), (3, 2010, 1.0), (5, 2010, 0.7)",
+    "INSERT INTO advisorp (aid1, aid2, probability) VALUES (1, 2, 0.8), (1, 3, 0.5), (4, 5, 0.6), "
+    "(6, 5, 0.3), (7, 2, 0.45), (7, 3, 0.35)",
+    "INSERT INTO affiliation (aid, inst) VALUES (1, 'A'), (2, 'A'), (3, 'B')",
+]
+
+QUERIES = [
+    (eq("aid1", 1) & eq("aid2", 2), ("V1",)),
+    (eq("aid1", 1) & eq("aid2", 3), ("V1",)),
+    (eq("aid1", 7), ("V1",)),
+    (eq("aid2", 2), ("V1",)),
+    (eq("aid2", 5), ("V1",)),
+    (eq("aid1", 6) & eq("aid2", 5), ("V1",)),
+    (eq("aid1", 1), ("V2",)),
+    (eq("aid1", 7), ("V1", "V2")),
+    (eq("aid1", 1) & eq("aid2", 2), None),  # V3(1, 2) always holds
+]
+
+
+def _brute_force_PQ(session, query, views):
+    # P(Q) by enumerating the worlds of the base tuples: a world is weighted by the
+    # probabilities of its base tuples times the weights of the view tuples holding in it.
+    # Views without atoms hold in every world and cancel out
+    variables, probabilities = [], {}
+    for table, columns in PROBABILISTIC_TABLES.items():
+        for row in session.execute(text(f"SELECT {', '.join(columns)}, probability FROM {table}")):
+            variable = (table,) + tuple(row[:len(columns)])
+            variables.append(variable)
+            probabilities[variable] = row.probability
+
+    tuples, matched = [], []
+    where, params = query.compile()
+    for view in MARKOVIEWS.values():
+        keys = view.key_columns
+        if views is None or view.name in views:
+            for row in session.execute(text(f"SELECT {', '.join(keys)} FROM {view.nv_table} WHERE {where}"),
+                                       params):
+                if not view.atoms:
+                    return 1.0
+                matched.append(_atoms(view, tuple(row)))
+        for row in session.execute(text(f"SELECT {', '.join(keys)}, weight FROM {view.nv_table}")):
+            if view.atoms:
+                tuples.append((_atoms(view, tuple(row[:len(keys)])), row.weight))
+
+    total = query_total = 0.0
+    for bits in itertools.product((False, True), repeat=len(variables)):
+        world = {variable for variable, bit in zip(variables, bits) if bit}
+        weight = math.prod(probabilities[v] if v in world else 1 - probabilities[v] for v in variables)
+        weight *= math.prod(tuple_weight for atoms, tuple_weight in tuples if atoms <= world)
+        total += weight
+        if any(atoms <= world for atoms in matched):
+            query_total += weight
+    return query_total / total
+
+
+def _atoms(view, key):
+    values = dict(zip(view.key_columns, key))
+    return {(table,) + tuple(values[column] for column in columns) for table, columns in view.atoms}
+
+
+@pytest.fixture
+def hand_built(sqlite_instance):
+    return sqlite_instance(0, scale=50, statements=HAND_BUILT)
+
+
+@pytest.mark.parametrize("query, views", QUERIES)
+def test_exact_compute_PQ_matches_enumeration(hand_built, query, views):
+    expected = _brute_force_PQ(hand_built, query, views)
+    assert exact_compute_PQ(hand_built, query, views) == pytest.approx(expected, abs=1e-12)
+
+
+def test_safe_plan_matches_compiled_lineage(hand_built):
+    hierarchical = 0
+    for query, views in QUERIES:
+        lineage = build_lineage(hand_built, query, views)
+        if lineage.constraint and is_hierarchical(lineage):
+            hierarchical += 1
+            assert safe_plan(hand_built, query) == pytest.approx(conditional_probability(lineage), abs=1e-12)
+    assert hierarchical >= 2
@@ -0,0 +1,47 @@
+import pytest
+from sqlalchemy import text
+
+from app.lineage import exact_compute_PQ
+from app.predicates import eq
+from app.topk import candidate_bounds, top_k
+
+
+def _exact_ranking(session, query=None):
+    # Every V1 answer evaluated exactly, in decreasing order
+    condition, params = ("TRUE", {}) if query is None else query.compile()
+    keys = session.execute(text(f"SELECT aid1, aid2 FROM nv1 WHERE {condition}"), params).all()
+    ranking = [(tuple(key), exact_compute_PQ(session, eq("aid1", key[0]) & eq("aid2", key[1]), views=("V1",)))
+               for key in keys]
+    return sorted(ranking, key=lambda answer: -answer[1])
+
+
+@pytest.mark.parametrize("seed", [7, 11, 13])
+def test_top_k_matches_exhaustive_ranking(sqlite_instance, seed):
+    session = sqlite_instance(seed, scale=1000)
+    ranking = _exact_ranking(session)
+    assert ranking
+    exact = dict(ranking)
+    for key, low, high in candidate_bounds(session):
+        assert low - 1e-9 <= exact[key] <= high + 1e-9
+
+    for k in (1, 3, len(ranking), len(ranking) + 5):
+        answers = top_k(session, k)
+        # Ties may come in another order: compare the probabilities, and each answer's own
+        assert [value for _, value in answers] == pytest.approx([value for _, value in ranking[:k]], abs=1e-9)
+        for key, value in answers:
+            assert value == pytest.approx(exact[key], abs=1e-9)
+
+
+def test_top_k_with_query(sqlite_instance):
+    session = sqlite_instance(7, scale=1000)
+    aid2 = session.execute(text("SELECT aid2 FROM nv1 GROUP BY aid2 ORDER BY COUNT(*) DESC, aid2")).scalar()
+    ranking = _exact_ranking(session, eq("aid2", aid2))
+    answers = top_k(session, 2, eq("aid2", aid2))
+    assert [value for _, value in answers] == pytest.approx([value for _, value in ranking[:2]], abs=1e-9)
+
+
+@pytest.mark.parametrize("k", [0, -1])
+def test_top_k_rejects_k_below_one(sqlite_instance, k):
+    session = sqlite_instance(7, scale=50)
+    with pytest.raises(ValueError):
+        top_k(session, k)
@@ -0,0 +1,62 @@
+import pytest
+from sqlalchemy import text
+
+from app.views import compute_PQ, compute_PQ_batch, compute_P0_W, get_nv_version, bump_nv_version, check_view_indexes, \
+    _aggregate_P0
+from app.predicates import eq
+from app.result_cache import RESULT_CACHE
+
+
+def test_P0_W_cache_is_per_database(sqlite_instance):
+    # Two in-memory databases at the same NV version must not share P0(W) or cached results.
+    # The tuples with w_0 = 1, which make P0(W) = 1, are removed first, so their P0(W) differ:
+    # these are the V1 tuples with weight 0.5 (one co-authored publication)
+    sessions = [sqlite_instance(seed, scale=50) for seed in (7, 11)]
+    for session in sessions:
+        for nv_table in ("nv1", "nv2", "nv3"):
+            session.execute(text(f"DELETE FROM {nv_table} WHERE w_0 = 1"))
+        session.commit()
+    assert get_nv_version(sessions[0]) == get_nv_version(sessions[1])
+    assert _aggregate_P0(sessions[0]) != _aggregate_P0(sessions[1])
+
+    query = eq("aid1", 1) & eq("aid2", 2)
+    for session in sessions + sessions:
+        assert compute_P0_W(session) == _aggregate_P0(session)
+        expected = compute_PQ(session, query)
+        RESULT_CACHE.invalidate()
+        assert compute_PQ(session, query) == pytest.approx(expected)
+
+
+def test_result_cache_invalidated_on_commit(sqlite_instance):
+    # bump_nv_version drops the cached results of its database when the transaction commits;
+    # a rolled back change keeps them
+    session = sqlite_instance(7, scale=50)
+    query = eq("aid1", 1) & eq("aid2", 2)
+    RESULT_CACHE.invalidate()
+    compute_PQ(session, query)
+    assert RESULT_CACHE.stats()["entries"] == 1
+
+    bump_nv_version(session)
+    assert RESULT_CACHE.stats()["entries"] == 1
+    session.rollback()
+    session.commit()
+    assert RESULT_CACHE.stats()["entries"] == 1
+
+    bump_nv_version(session)
+    session.commit()
+    assert RESULT_CACHE.stats()["entries"] == 0
+
+
+def test_batch_without_matching_nv_table(sqlite_instance):
+    # No NV table has both aid3 and inst: every key still comes back, as from compute_PQ
+    session = sqlite_instance(7, scale=50)
+    keys = [(1, "Institution 1"), (2, "Institution 2")]
+    expected = [(key, compute_PQ(session, eq("aid3", key[0]) & eq("inst", key[1]))) for key in keys]
+    assert sorted(compute_PQ_batch(session, keys, columns=("aid3", "inst"))) == expected
+
+
+def test_check_view_indexes_inspects_the_session_database(sqlite_instance):
+    session = sqlite_instance(7, scale=50)
+    assert not any(check_view_indexes(session).values())
+    session.execute(text("DROP INDEX ix_advisorp_aid2_aid1"))
+    assert ("advisorp", ("aid2",)) in check_view_indexes(session)["V1"]